@@ -1,6 +1,11 @@
-import pandas as pd
-import psycopg2
+import csv
+import datetime
+import io
 import logging
+import os
+import time
+import urllib.request
+from decimal import ROUND_HALF_UP, Decimal
 from io import StringIO
 from enum import Enum
 import traceback
@@ -10,203 +15,673 @@ class PlatformType(Enum):
     AMAZON = 'AMAZON'
     MEESHO = 'MEESHO'
 
+# Platform-specific CSV columns mapped to the common keys used below
+PLATFORM_TO_COMMON_KEYS = {
+    PlatformType.AMAZON.value: {
+        'OrderID': 'order_id',
+        'ProductID': 'product_id',
+        'ProductName': 'product_name',
+        'Category': 'category',
+        'QuantitySold': 'quantity_sold',
+        'SellingPrice': 'selling_price',
+        'DateOfSale': 'date_of_sale',
+        'CustomerID': 'customer_id',
+        'CustomerName': 'customer_name',
+        'ContactEmail': 'contact_email',
+        'PhoneNumber': 'phone_number',
+        'DeliveryAddress': 'delivery_address',
+        'DeliveryDate': 'delivery_date',
+        'DeliveryStatus': 'delivery_status',
+        'Platform': 'platform',  # Keep platform for reference
+        'PrimeDelivery': 'prime_delivery',
+        'WarehouseLocation': 'warehouse_location',
+    },
+    PlatformType.FLIPKART.value: {
+        'OrderID': 'order_id',
+        'ProductID': 'product_id',
+        'ProductName': 'product_name',
+        'Category': 'category',
+        'QuantitySold': 'quantity_sold',
+        'SellingPrice': 'selling_price',
+        'DateOfSale': 'date_of_sale',
+        'CustomerID': 'customer_id',
+        'CustomerName': 'customer_name',
+        'ContactEmail': 'contact_email',
+        'PhoneNumber': 'phone_number',
+        'DeliveryAddress': 'delivery_address',
+        'DeliveryDate': 'delivery_date',
+        'DeliveryStatus': 'delivery_status',
+        'Platform': 'platform',  # Keep platform for reference
+        'CouponUsed': 'coupon_used',
+        'ReturnWindow': 'return_window',
+    },
+    PlatformType.MEESHO.value: {
+        'OrderID': 'order_id',
+        'ProductID': 'product_id',
+        'ProductName': 'product_name',
+        'Category': 'category',
+        'QuantitySold': 'quantity_sold',
+        'SellingPrice': 'selling_price',
+        'DateOfSale': 'date_of_sale',
+        'CustomerID': 'customer_id',
+        'CustomerName': 'customer_name',
+        'ContactEmail': 'contact_email',
+        'PhoneNumber': 'phone_number',
+        'DeliveryAddress': 'delivery_address',
+        'DeliveryDate': 'delivery_date',
+        'DeliveryStatus': 'delivery_status',
+        'Platform': 'platform',  # Keep platform for reference
+        'ResellerName': 'reseller_name',
+        'CommissionPercentage': 'commission_percentage',
+    },
+}
+
+# Bumps the data version the API uses for caching and replica stickiness
+BUMP_DATA_VERSION_SQL = """
+    INSERT INTO mains_dataversion (id, version, updated_at)
+    VALUES (1, 1, now())
+    ON CONFLICT (id) DO UPDATE
+    SET version = mains_dataversion.version + 1, updated_at = now();
+"""
+
+# Recomputes the per-customer rollups (order count, lifetime revenue, sale dates, platforms) for a set of customers;
+# customers left without orders (all moved to another customer) are reset to zero
+REFRESH_CUSTOMER_ROLLUPS_SQL = """
+    UPDATE mains_customer c
+    SET order_count = r.order_count,
+        lifetime_revenue_paise = r.lifetime_revenue_paise,
+        first_sale_date = r.first_sale_date,
+        last_sale_date = r.last_sale_date,
+        platforms = r.platforms
+    FROM (
+        SELECT cu.customer_id,
+               COUNT(o.order_id) AS order_count,
+               COALESCE(SUM(o.quantity_sold * o.selling_price_paise), 0) AS lifetime_revenue_paise,
+               MIN(o.date_of_sale) AS first_sale_date,
+               MAX(o.date_of_sale) AS last_sale_date,
+               COALESCE(string_agg(DISTINCT p.platform_name, ',' ORDER BY p.platform_name), '') AS platforms
+        FROM mains_customer cu
+        LEFT JOIN mains_order o ON o.customer_id = cu.customer_id
+        LEFT JOIN mains_platform p ON p.id = o.platform_id
+        WHERE cu.customer_id = ANY(%s)
+        GROUP BY cu.customer_id
+    ) r
+    WHERE c.customer_id = r.customer_id;
+"""
+
+# Columns loaded into the staging table for delta ingestion, in COPY order
+STAGING_COLUMNS = [
+    'row_num', 'customer_id', 'customer_name', 'contact_email', 'phone_number', 'platform',
+    'order_id', 'product_id', 'product_name', 'category', 'quantity_sold', 'selling_price_paise',
+    'date_of_sale', 'coupon_used', 'return_window',
+    'delivery_address', 'delivery_date', 'delivery_status', 'delivery_partner',
+]
+
+# Columns the database declares NOT NULL; rows missing any of them are counted as failed
+REQUIRED_COLUMNS = [
+    'customer_id', 'customer_name', 'platform', 'order_id', 'product_id', 'product_name', 'category',
+    'date_of_sale', 'delivery_address', 'delivery_date', 'delivery_status',
+]
+
+def delta_ingest(cur, records):
+    """
+    Upserts cleaned CSV records with set-based statements instead of one INSERT per row.
+
+    The rows are COPYed into a temporary staging table and merged into the
+    order and delivery tables with INSERT ... ON CONFLICT DO UPDATE, where the
+    update only fires for rows whose values actually differ. Later rows win
+    when a file repeats an order ID.
+
+    Args:
+        cur: psycopg2 cursor inside an open transaction.
+        records: Row dicts with the common column names, as returned by load_csv.
+
+    Returns:
+        Dictionary of inserted, updated and unchanged order counts, the failed
+        row count, and the customers whose rollups changed.
+    """
+    defaults = {'product_id': None, 'product_name': None, 'coupon_used': False,
+                'return_window': 0, 'delivery_partner': None}
+    staged = []
+    failed_count = 0
+    for row_num, row in enumerate(records):
+        row = {**defaults, **row}  # Defaults fill absent columns only; a blank return_window stays NULL as in insert_rows
+        if row['coupon_used'] is None:
+            row['coupon_used'] = False  # NOT NULL column
+        if any(row.get(column) is None for column in REQUIRED_COLUMNS):
+            failed_count += 1
+            continue
+        row['row_num'] = row_num
+        row['customer_id'] = f"{row['platform']}_{row['customer_id']}"  # Same unique customer_id as the row-by-row path
+        if row.get('phone_number') is not None:
+            row['phone_number'] = str(row['phone_number'])[:20]  # Truncate if exceeding length limit
+        staged.append(row)
+
+    cur.execute("""
+        CREATE TEMP TABLE staging_orders (
+            row_num integer, customer_id varchar(255), customer_name varchar(255),
+            contact_email varchar(254), phone_number varchar(20), platform varchar(50),
+            order_id varchar(255), product_id varchar(255), product_name varchar(255),
+            category varchar(255), quantity_sold integer, selling_price_paise bigint,
+            date_of_sale date, coupon_used boolean, return_window integer,
+            delivery_address text, delivery_date date, delivery_status varchar(255),
+            delivery_partner varchar(255)
+        ) ON COMMIT DROP;
+    """)
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    for row in staged:
+        writer.writerow(['' if row.get(column) is None else row[column] for column in STAGING_COLUMNS])  # Unquoted empty is NULL
+    buffer.seek(0)
+    cur.copy_expert(f"COPY staging_orders ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+    # Keep only the last row per order so ON CONFLICT never touches a row twice
+    cur.execute("""
+        DELETE FROM staging_orders s
+        USING staging_orders later
+        WHERE later.order_id = s.order_id AND later.row_num > s.row_num;
+    """)
+
+    cur.execute("""
+        INSERT INTO mains_customer (customer_id, customer_name, contact_email, phone_number,
+                                    order_count, lifetime_revenue_paise, platforms)
+        SELECT DISTINCT ON (customer_id) customer_id, customer_name, contact_email, phone_number, 0, 0, ''
+        FROM staging_orders
+        ORDER BY customer_id, row_num DESC
+        ON CONFLICT (customer_id) DO NOTHING;
+    """)
+    cur.execute("""
+        INSERT INTO mains_platform (platform_name)
+        SELECT DISTINCT platform FROM staging_orders
+        ON CONFLICT (platform_name) DO NOTHING;
+    """)
+
+    # Customers that staged orders are moving away from; their rollups must be refreshed too
+    cur.execute("""
+        SELECT DISTINCT o.customer_id
+        FROM mains_order o
+        JOIN staging_orders s ON s.order_id = o.order_id
+        WHERE o.customer_id <> s.customer_id;
+    """)
+    previous_customers = [customer_id for (customer_id,) in cur.fetchall()]
+
+    cur.execute("""
+        INSERT INTO mains_order (
+            order_id, product_id, product_name, category, quantity_sold,
+            selling_price_paise, date_of_sale, customer_id, platform_id,
+            coupon_used, return_window
+        )
+        SELECT s.order_id, s.product_id, s.product_name, s.category, s.quantity_sold,
+               s.selling_price_paise, s.date_of_sale, s.customer_id, p.id,
+               s.coupon_used, s.return_window
+        FROM staging_orders s
+        JOIN mains_platform p ON p.platform_name = s.platform
+        ON CONFLICT (order_id) DO UPDATE SET
+            product_id = EXCLUDED.product_id, product_name = EXCLUDED.product_name,
+            category = EXCLUDED.category, quantity_sold = EXCLUDED.quantity_sold,
+            selling_price_paise = EXCLUDED.selling_price_paise, date_of_sale = EXCLUDED.date_of_sale,
+            customer_id = EXCLUDED.customer_id, platform_id = EXCLUDED.platform_id,
+            coupon_used = EXCLUDED.coupon_used, return_window = EXCLUDED.return_window
+        WHERE (mains_order.product_id, mains_order.product_name, mains_order.category,
+               mains_order.quantity_sold, mains_order.selling_price_paise, mains_order.date_of_sale,
+               mains_order.customer_id, mains_order.platform_id, mains_order.coupon_used,
+               mains_order.return_window)
+          IS DISTINCT FROM
+              (EXCLUDED.product_id, EXCLUDED.product_name, EXCLUDED.category,
+               EXCLUDED.quantity_sold, EXCLUDED.selling_price_paise, EXCLUDED.date_of_sale,
+               EXCLUDED.customer_id, EXCLUDED.platform_id, EXCLUDED.coupon_used,
+               EXCLUDED.return_window)
+        RETURNING order_id, (xmax = 0) AS inserted;
+    """)
+    changed_orders = dict(cur.fetchall())  # order_id -> True if inserted, False if updated
+
+    cur.execute("""
+        INSERT INTO mains_delivery (order_id, delivery_address, delivery_date, delivery_status, delivery_partner)
+        SELECT order_id, delivery_address, delivery_date, delivery_status, delivery_partner
+        FROM staging_orders
+        ON CONFLICT (order_id) DO UPDATE SET
+            delivery_address = EXCLUDED.delivery_address, delivery_date = EXCLUDED.delivery_date,
+            delivery_status = EXCLUDED.delivery_status, delivery_partner = EXCLUDED.delivery_partner
+        WHERE (mains_delivery.delivery_address, mains_delivery.delivery_date,
+               mains_delivery.delivery_status, mains_delivery.delivery_partner)
+          IS DISTINCT FROM
+              (EXCLUDED.delivery_address, EXCLUDED.delivery_date,
+               EXCLUDED.delivery_status, EXCLUDED.delivery_partner)
+        RETURNING order_id, (xmax = 0) AS inserted;
+    """)
+    changed_deliveries = dict(cur.fetchall())
+
+    # An order counts as inserted if its order row is new, updated if either of its rows changed
+    inserted = {order_id for order_id, is_new in changed_orders.items() if is_new}
+    updated = (set(changed_orders) | set(changed_deliveries)) - inserted
+
+    # Customers whose rollups need refreshing, read before the staging table is dropped
+    affected_customers = []
+    if inserted or updated:
+        cur.execute("""
+            SELECT array_agg(DISTINCT customer_id)
+            FROM staging_orders
+            WHERE order_id = ANY(%s);
+        """, (list(inserted | updated),))
+        (affected_customers,) = cur.fetchone()
+
+    cur.execute("DROP TABLE staging_orders")  # Several files can share one transaction
+
+    return {
+        'inserted': len(inserted),
+        'updated': len(updated),
+        'unchanged': len({row['order_id'] for row in staged}) - len(inserted) - len(updated),
+        'failed': failed_count,
+        'affected_customers': sorted(set(affected_customers or []) | set(previous_customers)),
+    }
+
+
+def get_connection():
+    """
+    Opens a connection to the PostgreSQL database.
+
+    **In production, retrieve credentials from AWS Secrets Manager**; the
+    DB_* environment variables override the defaults below.
+    """
+    import psycopg2  # Imported on first use to keep cold starts short
+
+    return psycopg2.connect(
+        host=os.environ.get('DB_HOST', "demo-pgdb-kumarankur2106.d.aivencloud.com"),
+        database=os.environ.get('DB_NAME', "defaultdb"),
+        user=os.environ.get('DB_USER', "avnadmin"),
+        password=os.environ.get('DB_PASSWORD', "AVNS_tUouQ3erHSA2RJqqTkE"),
+        port=int(os.environ.get('DB_PORT', 15662)),
+    )
+
+# Date formats tried when inferring a column's format, month first like pd.to_datetime(dayfirst=False)
+DATE_FORMATS = [
+    '%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y/%m/%d',
+    '%m/%d/%Y', '%d/%m/%Y', '%m-%d-%Y', '%d-%m-%Y', '%m.%d.%Y', '%d.%m.%Y',
+    '%b %d, %Y', '%B %d, %Y', '%d %b %Y', '%d %B %Y',
+]
+
+def _strptime(value, date_format):
+    try:
+        return datetime.datetime.strptime(value, date_format).date()
+    except ValueError:
+        return None
+
+def _infer_date_format(values):
+    """
+    Picks the format of a date column from its first non-empty value, as pandas does;
+    returns None when no known format matches.
+    """
+    for value in values:
+        if value and value.strip():
+            return next((f for f in DATE_FORMATS if _strptime(value.strip(), f)), None)
+    return None
+
+def _parse_date(value, date_format=None):
+    """
+    Parses a date with the column's inferred format; returns None for values that
+    do not match it, like pd.to_datetime(errors='coerce').
+    """
+    value = (value or '').strip()
+    if not value:
+        return None
+    if date_format:
+        return _strptime(value, date_format)
+    return next(filter(None, (_strptime(value, f) for f in DATE_FORMATS)), None)  # Column format unknown
+
+def _to_paise(value):
+    """
+    Converts a rupee amount as written in the CSV ('199.5') into integer paise (19950), exactly.
+    """
+    return int((Decimal(str(value).strip()) * 100).to_integral_value(ROUND_HALF_UP))
+
+def _clean_record(row, date_formats):
+    """
+    Cleans one csv.DictReader row into the same types the pandas engine produces.
+    """
+    row = {key: (value if value != '' else None) for key, value in row.items()}  # Empty cells are missing values
+    row['date_of_sale'] = _parse_date(row.get('date_of_sale'), date_formats['date_of_sale'])
+    row['delivery_date'] = _parse_date(row.get('delivery_date'), date_formats['delivery_date'])
+
+    # Handle potential data type and length issues
+    row['quantity_sold'] = int(float(row['quantity_sold'])) if row.get('quantity_sold') else 0
+    row['selling_price_paise'] = _to_paise(row.pop('selling_price', None) or 0)  # Exact integer paise, no float step
+    row['customer_id'] = str(row.get('customer_id'))  # Ensure CustomerID is string
+    if row.get('return_window') is not None:
+        row['return_window'] = int(float(row['return_window']))
+    if row.get('coupon_used') is not None:
+        row['coupon_used'] = row['coupon_used'].strip().lower() in ('true', '1', 'yes')
+    return row
+
+def read_csv_records(source):
+    """
+    Reads and cleans a CSV with the standard library csv module only.
+
+    Args:
+        source: URL or local path of the CSV file.
+
+    Returns:
+        List of row dicts with the common column names.
+    """
+    if '://' in source:
+        stream = io.TextIOWrapper(urllib.request.urlopen(source), encoding='utf-8-sig', newline='')
+    else:
+        stream = open(source, encoding='utf-8-sig', newline='')
+    with stream:
+        reader = csv.DictReader(stream)
+        rows = list(reader)
+    if not rows:
+        return []
+
+    # 3. Platform Detection and Data Mapping
+    platform_type = rows[0]['Platform'].upper()  # Get platform type from first row
+
+    # Ensure platform is supported
+    if platform_type not in PLATFORM_TO_COMMON_KEYS.keys():
+        raise ValueError(f"Unsupported platform: {platform_type}")
+
+    # Map platform-specific columns to common keys, then clean each row
+    common_keys = PLATFORM_TO_COMMON_KEYS[platform_type]
+    rows = [{common_keys.get(key, key): value for key, value in row.items()} for row in rows]
+    date_formats = {column: _infer_date_format(row.get(column) for row in rows)  # One format per column, like pandas
+                    for column in ('date_of_sale', 'delivery_date')}
+    return [_clean_record(row, date_formats) for row in rows]
+
+def read_csv_records_pandas(source):
+    """
+    Reads and cleans a CSV with pandas, which is imported only when this engine is used.
+
+    Args:
+        source: URL or local path of the CSV file.
+
+    Returns:
+        List of row dicts with the common column names.
+    """
+    import numpy as np
+    import pandas as pd
+
+    # 2. Fetch data from CSV URL; every column is read as text and only the numeric ones are converted below,
+    # so IDs and phone numbers keep their digits and nullable integers never become floats ('7.0')
+    csv_data = pd.read_csv(source, dtype=str)
+
+    # 3. Platform Detection and Data Mapping
+    platform_type = csv_data['Platform'].iloc[0].upper()  # Get platform type from first row
+
+    # Ensure platform is supported
+    if platform_type not in PLATFORM_TO_COMMON_KEYS.keys():
+        raise ValueError(f"Unsupported platform: {platform_type}")
+
+    # Map platform-specific columns to common keys
+    common_keys = PLATFORM_TO_COMMON_KEYS[platform_type]
+    csv_data = csv_data.rename(columns=common_keys)
+    # 4. Data Cleaning and Transformation
+    csv_data['date_of_sale'] = pd.to_datetime(csv_data['date_of_sale'], errors='coerce').dt.date
+    csv_data['delivery_date'] = pd.to_datetime(csv_data['delivery_date'], errors='coerce').dt.date
+
+    # Handle potential data type and length issues
+    csv_data['quantity_sold'] = pd.to_numeric(csv_data['quantity_sold']).fillna(0).astype(int)
+    # Rupees to integer paise, rounding half away from zero like Decimal ROUND_HALF_UP in _to_paise and
+    # mains.money.to_paise; the round(6) first drops binary float error (1.005 * 100 = 100.49999999999999)
+    paise = np.round(pd.to_numeric(csv_data.pop('selling_price')).fillna(0).to_numpy(dtype=np.float64) * 100, 6)
+    csv_data['selling_price_paise'] = (np.sign(paise) * np.floor(np.abs(paise) + 0.5)).astype(np.int64)
+    csv_data['customer_id'] = csv_data['customer_id'].astype(str)  # Ensure CustomerID is string
+    if 'return_window' in csv_data:
+        csv_data['return_window'] = pd.to_numeric(csv_data['return_window']).astype('Int64')  # Nullable integer
+    if 'coupon_used' in csv_data:
+        csv_data['coupon_used'] = csv_data['coupon_used'].str.strip().str.lower().isin(['true', '1', 'yes']).where(
+            csv_data['coupon_used'].notna())
+
+    csv_data = csv_data.astype(object).where(csv_data.notna(), None)  # NaN/NaT become None, values become Python types
+    return csv_data.to_dict('records')
+
+CSV_ENGINES = {
+    'csv': read_csv_records,
+    'pandas': read_csv_records_pandas,
+}
+
+def load_csv(csv_url, engine=None):
+    """
+    Fetches a CSV from a Google Drive share link, detects its platform and
+    returns it cleaned, with the platform columns mapped to common keys.
+
+    Args:
+        csv_url: Google Drive share link of the CSV file.
+        engine: 'csv' (standard library, the default) or 'pandas';
+            defaults to the INGEST_CSV_ENGINE environment variable.
+
+    Returns:
+        List of row dicts with the common column names.
+    """
+    engine = engine or os.environ.get('INGEST_CSV_ENGINE', 'csv')
+    if engine not in CSV_ENGINES:
+        raise ValueError(f"Unsupported CSV engine: {engine}")
+
+    # 1. Build the direct download URL and fetch the data
+    csv_url='https://drive.google.com/uc?id=' + csv_url.split('/')[-2]
+    return CSV_ENGINES[engine](csv_url)
+
+def insert_rows(cur, records):
+    """
+    Inserts cleaned CSV records row by row inside the caller's transaction.
+
+    Each row runs in its own savepoint, so a bad row is rolled back and
+    counted without losing the rows around it.
+
+    Args:
+        cur: psycopg2 cursor inside an open transaction.
+        records: Row dicts with the common column names, as returned by load_csv.
+
+    Returns:
+        Dictionary of success and failed row counts and the customers touched.
+    """
+    logger = logging.getLogger()
+    success_count = 0
+    failed_count = 0
+    touched_customers = set()  # Customers whose rollups need refreshing after the load
+
+    for index, row in enumerate(records):
+        cur.execute("SAVEPOINT ingest_row")
+        try:
+        # if True:
+            # 6.1 Create unique customer_id 
+            customer_id = f"{row['platform']}_{row['customer_id']}" 
+
+            # 6.2 Insert into Customer table (if not already exists)
+            customer_name = row['customer_name'] 
+            contact_email = row['contact_email'] 
+            phone_number = row['phone_number'] 
+            if phone_number and len(phone_number) > 20:
+                phone_number = phone_number[:20]  # Truncate if exceeding length limit
+
+            cur.execute("""
+                INSERT INTO mains_customer (customer_id, customer_name, contact_email, phone_number,
+                                            order_count, lifetime_revenue_paise, platforms)
+                VALUES (%s, %s, %s, %s, 0, 0, '')  -- Empty rollups; finish_ingest fills them in
+                ON CONFLICT (customer_id) DO NOTHING; 
+            """, (customer_id, customer_name, contact_email, phone_number))
+
+            # 6.3 Insert into Platform table (if not already exists)
+            platform_name = row['platform']
+            cur.execute("""
+                INSERT INTO mains_platform (platform_name)
+                VALUES (%s)
+                ON CONFLICT (platform_name) DO NOTHING;
+            """, (platform_name,))
+
+            # 6.4 Insert into Orders table
+            order_id = row['order_id'] 
+            product_id = row['product_id'] if 'product_id' in row else None 
+            product_name = row['product_name'] if 'product_name' in row else None 
+            quantity_sold = row['quantity_sold'] 
+            selling_price_paise = row['selling_price_paise'] 
+            date_of_sale = row['date_of_sale'] 
+
+            # Retrieve platform_id (assumes platform_name is unique)
+            cur.execute("SELECT id FROM mains_platform WHERE platform_name = %s", (platform_name,))
+            platform_id = cur.fetchone()[0] 
+            coupon_used = row['coupon_used'] if 'coupon_used' in row else False 
+            return_window = row['return_window'] if 'return_window' in row else 0 
+            cur.execute("""
+                INSERT INTO mains_order (
+                    order_id, product_id, product_name, category, quantity_sold, 
+                    selling_price_paise, date_of_sale, customer_id, platform_id, 
+                    coupon_used, return_window
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, (order_id, product_id, product_name, row['category'], quantity_sold, 
+                   selling_price_paise, date_of_sale, customer_id, platform_id, 
+                   coupon_used, return_window))
+
+            # 6.5 Insert into Deliveries table
+            delivery_address = row['delivery_address'] 
+            delivery_date = row['delivery_date'] 
+            delivery_status = row['delivery_status'] 
+            delivery_partner = row['delivery_partner'] if 'delivery_partner' in row else None 
+            cur.execute("""
+                INSERT INTO mains_delivery (order_id, delivery_address, delivery_date, delivery_status, delivery_partner)
+                VALUES (%s, %s, %s, %s, %s)
+            """, (row['order_id'], delivery_address, delivery_date, delivery_status, delivery_partner))
+
+            cur.execute("RELEASE SAVEPOINT ingest_row")
+            success_count += 1
+            touched_customers.add(customer_id)
+        except Exception as e:
+            logger.error(f"Error processing row {index+1}: {str(e)} Traceback : {traceback.format_exc()}")
+            failed_count += 1
+            cur.execute("ROLLBACK TO SAVEPOINT ingest_row")
+
+    return {
+        'success': success_count,
+        'failed': failed_count,
+        'affected_customers': list(touched_customers),
+    }
+
+def ingest(cur, records, mode='insert'):
+    """
+    Loads one cleaned CSV file's records inside the caller's transaction.
+
+    Args:
+        cur: psycopg2 cursor inside an open transaction.
+        records: Row dicts with the common column names, as returned by load_csv.
+        mode: 'insert' to insert row by row, 'delta' to bulk-upsert (see delta_ingest).
+
+    Returns:
+        Dictionary of counts, the affected customers, whether anything
+        changed, and a human-readable summary message.
+    """
+    if mode == 'delta':
+        counts = delta_ingest(cur, records)
+        counts['changed'] = bool(counts['inserted'] or counts['updated'])
+        counts['message'] = (f"Processed {len(records)} rows. Inserted: {counts['inserted']}, Updated: {counts['updated']}, "
+                             f"Unchanged: {counts['unchanged']}, Failed: {counts['failed']}")
+    elif mode == 'insert':
+        counts = insert_rows(cur, records)
+        counts['changed'] = bool(counts['success'])
+        counts['message'] = f"Processed {len(records)} rows. Success: {counts['success']}, Failed: {counts['failed']}"
+    else:
+        raise ValueError(f"Unsupported ingest mode: {mode}")
+    counts['rows'] = len(records)
+    return counts
+
+def finish_ingest(cur, affected_customers):
+    """
+    Refreshes the customer rollups in one statement and bumps the data version,
+    so the API keeps reads on the primary until replicas catch up.
+    Call once per transaction that changed data.
+    """
+    cur.execute(REFRESH_CUSTOMER_ROLLUPS_SQL, (list(affected_customers),))
+    cur.execute(BUMP_DATA_VERSION_SQL)
+
+# Seconds between queue polls while waiting for a job, and the margin left before the Lambda timeout
+INGEST_POLL_SECONDS = 2.0
+LAMBDA_TIMEOUT_MARGIN_SECONDS = 10.0
+
+
+def _wait_budget(context):
+    """
+    Returns how many seconds the handler may wait for its job: the invocation's
+    remaining time less a safety margin, or INGEST_WAIT_SECONDS when run outside Lambda.
+    """
+    if context is None:
+        return float(os.environ.get('INGEST_WAIT_SECONDS', 60))
+    return context.get_remaining_time_in_millis() / 1000 - LAMBDA_TIMEOUT_MARGIN_SECONDS
+
+
 def lambda_handler(event, context):
     """
-    Fetches data from a CSV URL, cleans and transforms it, 
-    and inserts into a PostgreSQL database, handling foreign keys, data integrity, and errors.
+    Queues a CSV URL for ingestion and drains the local ingestion queue.
+
+    This is a thin adapter onto ingest_queue: the worker fetches, cleans and
+    loads the file into PostgreSQL with batching, capped concurrent writers
+    and retries. The handler keeps working on the shared queue until its own
+    job is done or failed; only when the invocation is about to time out is
+    it answered with 202, and the job can then be polled with {'job_id': ...}.
+
+    No connection is held while waiting: enqueueing and each status poll use
+    a short-lived connection, and the worker keeps one only while it holds a
+    writer slot, so a burst of uploads opens at most max_writers lasting connections.
 
     Args:
-        event: AWS Lambda event object.
+        event: AWS Lambda event object with 'csv_url' and optional 'mode'
+            ('insert' or 'delta'), or 'job_id' to query a job's status.
         context: AWS Lambda context object.
 
     Returns:
         Dictionary containing the success message or error details.
     """
+    from ingest_queue import IngestWorker, QueueFull, default_queue, is_runnable  # ingest_queue imports this module
 
     logger = logging.getLogger()
     logger.setLevel(logging.INFO)
-    # if True:
     try:
-        # 1. Get CSV URL from event
-        csv_url = event['csv_url'] 
-        csv_url='https://drive.google.com/uc?id=' + csv_url.split('/')[-2]
-
-        # 2. Fetch data from CSV URL
-        csv_data = pd.read_csv(csv_url)
-
-        # 3. Platform Detection and Data Mapping
-        platform_type = csv_data['Platform'].iloc[0].upper()  # Get platform type from first row
-        platform_to_common_keys = {
-            PlatformType.AMAZON.value: {
-                'OrderID': 'order_id',
-                'ProductID': 'product_id',
-                'ProductName': 'product_name',
-                'Category': 'category',
-                'QuantitySold': 'quantity_sold',
-                'SellingPrice': 'selling_price',
-                'DateOfSale': 'date_of_sale',
-                'CustomerID': 'customer_id',
-                'CustomerName': 'customer_name',
-                'ContactEmail': 'contact_email',
-                'PhoneNumber': 'phone_number',
-                'DeliveryAddress': 'delivery_address',
-                'DeliveryDate': 'delivery_date',
-                'DeliveryStatus': 'delivery_status',
-                'Platform': 'platform',  # Keep platform for reference
-                'PrimeDelivery': 'prime_delivery',
-                'WarehouseLocation': 'warehouse_location',
-            },
-            PlatformType.FLIPKART.value: {
-                'OrderID': 'order_id',
-                'ProductID': 'product_id',
-                'ProductName': 'product_name',
-                'Category': 'category',
-                'QuantitySold': 'quantity_sold',
-                'SellingPrice': 'selling_price',
-                'DateOfSale': 'date_of_sale',
-                'CustomerID': 'customer_id',
-                'CustomerName': 'customer_name',
-                'ContactEmail': 'contact_email',
-                'PhoneNumber': 'phone_number',
-                'DeliveryAddress': 'delivery_address',
-                'DeliveryDate': 'delivery_date',
-                'DeliveryStatus': 'delivery_status',
-                'Platform': 'platform',  # Keep platform for reference
-                'CouponUsed': 'coupon_used',
-                'ReturnWindow': 'return_window',
-            },
-            PlatformType.MEESHO.value: {
-                'OrderID': 'order_id',
-                'ProductID': 'product_id',
-                'ProductName': 'product_name',
-                'Category': 'category',
-                'QuantitySold': 'quantity_sold',
-                'SellingPrice': 'selling_price',
-                'DateOfSale': 'date_of_sale',
-                'CustomerID': 'customer_id',
-                'CustomerName': 'customer_name',
-                'ContactEmail': 'contact_email',
-                'PhoneNumber': 'phone_number',
-                'DeliveryAddress': 'delivery_address',
-                'DeliveryDate': 'delivery_date',
-                'DeliveryStatus': 'delivery_status',
-                'Platform': 'platform',  # Keep platform for reference
-                'ResellerName': 'reseller_name',
-                'CommissionPercentage': 'commission_percentage',
-            },
-        }
-
-        # Ensure platform is supported
-        if platform_type not in platform_to_common_keys.keys():
-            raise ValueError(f"Unsupported platform: {platform_type}")
-
-        # Map platform-specific columns to common keys
-        common_keys = platform_to_common_keys[platform_type]
-        csv_data = csv_data.rename(columns=common_keys)
-        # 4. Data Cleaning and Transformation
-        csv_data['date_of_sale'] = pd.to_datetime(csv_data['date_of_sale'], errors='coerce')
-        csv_data['delivery_date'] = pd.to_datetime(csv_data['delivery_date'], errors='coerce')
-
-        # Handle potential data type and length issues
-        csv_data['quantity_sold'] = csv_data['quantity_sold'].fillna(0).astype(int)
-        csv_data['selling_price'] = csv_data['selling_price'].fillna(0).astype(float)
-        csv_data['customer_id'] = csv_data['customer_id'].astype(str)  # Ensure CustomerID is string
-
-        # 5. Connect to PostgreSQL database
-        # **In production, retrieve credentials from AWS Secrets Manager**
-        host = "demo-pgdb-kumarankur2106.d.aivencloud.com" 
-        database = "defaultdb"
-        user = "avnadmin"
-        password = "AVNS_tUouQ3erHSA2RJqqTkE" 
-        port= 15662
-
-        conn = psycopg2.connect(
-            host=host,
-            database=database,
-            user=user,
-            password=password,
-            port= port,
-        )
-        cur = conn.cursor()
-
-        # 6. Insert data into PostgreSQL
-        success_count = 0
-        failed_count = 0
-
-        for index, row in csv_data.iterrows():
-            try:
-            # if True:
-                # 6.1 Create unique customer_id 
-                customer_id = f"{row['platform']}_{row['customer_id']}" 
-
-                # 6.2 Insert into Customer table (if not already exists)
-                customer_name = row['customer_name'] 
-                contact_email = row['contact_email'] 
-                phone_number = row['phone_number'] 
-                if phone_number and len(phone_number) > 20:
-                    phone_number = phone_number[:20]  # Truncate if exceeding length limit
-
-                cur.execute("""
-                    INSERT INTO mains_customer (customer_id, customer_name, contact_email, phone_number)
-                    VALUES (%s, %s, %s, %s)
-                    ON CONFLICT (customer_id) DO NOTHING; 
-                """, (customer_id, customer_name, contact_email, phone_number))
-
-                # 6.3 Insert into Platform table (if not already exists)
-                platform_name = row['platform']
-                cur.execute("""
-                    INSERT INTO mains_platform (platform_name)
-                    VALUES (%s)
-                    ON CONFLICT (platform_name) DO NOTHING;
-                """, (platform_name,))
-
-                # 6.4 Insert into Orders table
-                order_id = row['order_id'] 
-                product_id = row['product_id'] if 'product_id' in row else None 
-                product_name = row['product_name'] if 'product_name' in row else None 
-                quantity_sold = row['quantity_sold'] 
-                selling_price = row['selling_price'] 
-                date_of_sale = row['date_of_sale'] 
-
-                # Retrieve platform_id (assumes platform_name is unique)
-                cur.execute("SELECT id FROM mains_platform WHERE platform_name = %s", (platform_name,))
-                platform_id = cur.fetchone()[0] 
-                coupon_used = row['coupon_used'] if 'coupon_used' in row else False 
-                return_window = row['return_window'] if 'return_window' in row else 0 
-                cur.execute("""
-                    INSERT INTO mains_order (
-                        order_id, product_id, product_name, category, quantity_sold, 
-                        selling_price, date_of_sale, customer_id, platform_id, 
-                        coupon_used, return_window
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """, (order_id, product_id, product_name, row['category'], quantity_sold, 
-                       selling_price, date_of_sale, customer_id, platform_id, 
-                       coupon_used, return_window))
-
-                # 6.5 Insert into Deliveries table
-                delivery_address = row['delivery_address'] 
-                delivery_date = row['delivery_date'] 
-                delivery_status = row['delivery_status'] 
-                delivery_partner = row['delivery_partner'] if 'delivery_partner' in row else None 
-                cur.execute("""
-                    INSERT INTO mains_delivery (order_id, delivery_address, delivery_date, delivery_status, delivery_partner)
-                    VALUES (%s, %s, %s, %s, %s)
-                """, (row['order_id'], delivery_address, delivery_date, delivery_status, delivery_partner))
-
-                success_count += 1
-                conn.commit()
-            except Exception as e:
-                logger.error(f"Error processing row {index+1}: {str(e)} Traceback : {traceback.format_exc()}")
-                failed_count += 1
-                conn.rollback()
-
-        cur.close()
-        conn.close()
-
-        logger.info(f"Processed {len(csv_data)} rows. Success: {success_count}, Failed: {failed_count}")
+        queue = default_queue()
+
+        if 'job_id' in event:
+            job = queue.get(event['job_id'])
+            return {
+                'statusCode': 200 if job else 404,
+                'body': job['status'] if job else f"Unknown job: {event['job_id']}",
+                'job': job,
+            }
+
+        # 1. Get CSV URL from event and queue it
+        try:
+            job_id = queue.enqueue(event['csv_url'], mode=event.get('mode', 'insert'))
+        except QueueFull as e:
+            logger.warning(str(e))
+            return {
+                'statusCode': 429,
+                'body': str(e),
+            }
+
+        # 2. Work on the queue until our job finishes; it may be waiting on a writer slot,
+        # on its retry, or already be running in another invocation
+        worker = IngestWorker(queue)
+        deadline = time.monotonic() + _wait_budget(context)
+        job = queue.get(job_id)
+        while job['status'] not in ('done', 'failed'):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not is_runnable(job) or worker.run_until_idle() is None:  # Nothing to do here, or no free writer slot
+                time.sleep(min(INGEST_POLL_SECONDS, remaining))
+            job = queue.get(job_id)
+
+        if job['status'] == 'done':
+            logger.info(job['result']['message'])
+            return {
+                'statusCode': 200,
+                'body': job['result']['message'],
+                'job': job,
+            }
+        if job['status'] == 'failed':
+            return {
+                'statusCode': 500,
+                'body': f"General Error: {job['last_error']}",
+                'job': job,
+            }
         return {
-            'statusCode': 200,
-            'body': f"Processed {len(csv_data)} rows. Success: {success_count}, Failed: {failed_count}"
+            'statusCode': 202,
+            'body': f"Job {job_id} is {job['status']}",
+            'job': job,
         }
 
     except Exception as e:
@@ -0,0 +1,119 @@
+"""
+Startup benchmark for the Lambda parser and the Django app.
+
+Each measurement runs in a fresh interpreter, like a cold start:
+
+- parser: import time of aws_lambda_parser, then the first parse of a CSV
+  with the 'csv' (standard library) and 'pandas' engines.
+- django: django.setup() plus URL/middleware loading, then the first request,
+  with the full settings and the lean fihub_project.settings_api profile.
+
+Usage:
+    python bench_startup.py [--repeat 5] [--csv path/to/file.csv] [--path /dashboard/]
+
+Without --csv a small synthetic Amazon export is generated. Paths other than
+/dashboard/ need a reachable database (FIHUB_SQLITE=1 works after migrate).
+"""
+import argparse
+import csv
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PARSER_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import aws_lambda_parser
+imported = time.perf_counter()
+records = aws_lambda_parser.CSV_ENGINES[sys.argv[1]](sys.argv[2])
+parsed = time.perf_counter()
+print(json.dumps({'import': imported - start, 'first': parsed - imported, 'rows': len(records)}))
+"""
+
+DJANGO_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+from django.test import Client
+client = Client(HTTP_HOST='localhost')
+client.handler.load_middleware()
+from django.urls import get_resolver
+get_resolver().url_patterns  # Import the URLconf and views
+imported = time.perf_counter()
+response = client.get(sys.argv[1])
+answered = time.perf_counter()
+print(json.dumps({'import': imported - start, 'first': answered - imported, 'status': response.status_code}))
+"""
+
+
+def write_sample_csv(path, rows=1000):
+    header = ['OrderID', 'ProductID', 'ProductName', 'Category', 'QuantitySold', 'SellingPrice', 'DateOfSale',
+              'CustomerID', 'CustomerName', 'ContactEmail', 'PhoneNumber', 'DeliveryAddress', 'DeliveryDate',
+              'DeliveryStatus', 'Platform', 'PrimeDelivery', 'WarehouseLocation']
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for i in range(rows):
+            writer.writerow([f'A{i}', f'P{i % 50}', 'Product', 'Electronics', i % 5 + 1, f'{100 + i % 900}.50',
+                             f'2024-{i % 12 + 1:02d}-15', i % 300, 'Customer', 'c@example.com', '9876543210',
+                             'Address', f'2024-{i % 12 + 1:02d}-20', 'Delivered', 'Amazon', 'True', 'Pune'])
+
+
+def probe(code, args, env=None):
+    output = subprocess.run(
+        [sys.executable, '-c', code, *args], cwd=BASE_DIR, env={**os.environ, **(env or {})},
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def median_ms(samples, key):
+    return statistics.median(sample[key] for sample in samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help="Cold starts per mode; medians are reported")
+    parser.add_argument('--csv', help="CSV file for the parser benchmark")
+    parser.add_argument('--path', default='/dashboard/', help="URL for the first-request measurement")
+    args = parser.parse_args()
+
+    csv_path = args.csv
+    if csv_path is None:
+        csv_path = os.path.join(tempfile.mkdtemp(), 'amazon_sample.csv')
+        write_sample_csv(csv_path)
+
+    modes = [('parser/' + engine, PARSER_PROBE, [engine, csv_path], None) for engine in ('csv', 'pandas')]
+    modes += [(settings_module, DJANGO_PROBE, [args.path], {'DJANGO_SETTINGS_MODULE': settings_module})
+              for settings_module in ('fihub_project.settings', 'fihub_project.settings_api')]
+
+    # Modes take turns, alternating direction, so drift in machine load or disk cache hits them equally
+    samples, errors = {label: [] for label, *_ in modes}, {}
+    for i in range(args.repeat):
+        for label, code, probe_args, env in (modes if i % 2 == 0 else modes[::-1]):
+            if label in errors:
+                continue
+            try:
+                samples[label].append(probe(code, probe_args, env))
+            except subprocess.CalledProcessError as e:
+                errors[label] = e.stderr.strip().splitlines()[-1]
+
+    print(f"{'mode':<36}{'import ms':>12}{'first call ms':>16}")
+    for label, *_ in modes:
+        if label in errors:
+            print(f"{label:<36}failed: {errors[label]}")
+            continue
+        line = f"{label:<36}{median_ms(samples[label], 'import'):>12.1f}{median_ms(samples[label], 'first'):>16.1f}"
+        if 'status' in samples[label][-1]:
+            line += f"  (HTTP {samples[label][-1]['status']} for {args.path})"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -42,6 +42,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # gzip/zstd negotiation; keep above anything else that reads or writes the response body
+    'mains.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -93,6 +95,59 @@ DATABASES = {
     }
 }
 
+# Optional read replica for the analytics views and exports.
+# Any REPLICA_DB_* variable that is not set falls back to the primary's value.
+if os.environ.get('REPLICA_DB_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.environ.get('REPLICA_DB_NAME', DATABASES['default']['NAME']),
+        'USER': os.environ.get('REPLICA_DB_USER', DATABASES['default']['USER']),
+        'PASSWORD': os.environ.get('REPLICA_DB_PASSWORD', DATABASES['default']['PASSWORD']),
+        'HOST': os.environ['REPLICA_DB_HOST'],
+        'PORT': os.environ.get('REPLICA_DB_PORT', DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+# Local development: FIHUB_SQLITE=1 swaps both databases for SQLite stand-ins.
+# Copy db.sqlite3 over db_replica.sqlite3 to "replicate".
+if os.environ.get('FIHUB_SQLITE'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        },
+        'replica': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db_replica.sqlite3',
+            'TEST': {'MIRROR': 'default'},
+        },
+    }
+
+DATABASE_ROUTERS = ['mains.routers.AnalyticsReplicaRouter']
+
+# Alias the analytics views read from; falls back to 'default' when it is not configured or unreachable
+ANALYTICS_DB_ALIAS = os.environ.get('ANALYTICS_DB_ALIAS', 'replica')
+
+# How long an unreachable replica is skipped before it is tried again
+REPLICA_RETRY_SECONDS = int(os.environ.get('REPLICA_RETRY_SECONDS', 30))
+
+# Backend for the monthly and summary analytics views:
+# 'database' aggregates in SQL, 'memory' answers from a NumPy columnar snapshot of the orders
+ANALYTICS_BACKEND = os.environ.get('ANALYTICS_BACKEND', 'database')
+
+# Directory for memory-mapped snapshot files shared by all workers on a host; unset keeps snapshots per process
+ANALYTICS_SNAPSHOT_DIR = os.environ.get('ANALYTICS_SNAPSHOT_DIR')
+
+# Number of snapshot versions kept on disk
+ANALYTICS_SNAPSHOT_KEEP = int(os.environ.get('ANALYTICS_SNAPSHOT_KEEP', 2))
+
+# Orders sampled per month, and HyperLogLog precision (2**p registers), for approx=true analytics
+ANALYTICS_SAMPLE_SIZE = int(os.environ.get('ANALYTICS_SAMPLE_SIZE', 2000))
+ANALYTICS_HLL_PRECISION = int(os.environ.get('ANALYTICS_HLL_PRECISION', 12))
+
+# How long the ingestion data version is cached in each worker
+DATA_VERSION_CACHE_SECONDS = float(os.environ.get('DATA_VERSION_CACHE_SECONDS', 1))
+
 
 # Password validation
 
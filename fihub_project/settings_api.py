@@ -0,0 +1,43 @@
+"""
+Lean settings profile for the read-only analytics API.
+
+Drops admin, auth, sessions and messages (apps, middleware and template
+context processors) that no API view uses, which shortens Lambda cold
+starts and worker boots. Select it with
+DJANGO_SETTINGS_MODULE=fihub_project.settings_api.
+"""
+
+from fihub_project.settings import *  # noqa: F401,F403
+
+UNUSED_APPS = (
+    'django.contrib.admin',
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+)
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in UNUSED_APPS]
+
+# Every view is a GET, so CSRF, sessions, auth and messages have nothing to do
+UNUSED_MIDDLEWARE = (
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+)
+MIDDLEWARE = [middleware for middleware in MIDDLEWARE if middleware not in UNUSED_MIDDLEWARE]
+
+TEMPLATES[0]['OPTIONS']['context_processors'] = [
+    'django.template.context_processors.debug',
+    'django.template.context_processors.request',
+]
+
+AUTH_PASSWORD_VALIDATORS = []
+
+# Without django.contrib.auth, DRF must not try to build users or render the browsable API
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [],
+    'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.AllowAny'],
+    'DEFAULT_RENDERER_CLASSES': ['rest_framework.renderers.JSONRenderer'],
+    'UNAUTHENTICATED_USER': None,
+}
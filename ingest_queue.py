@@ -0,0 +1,528 @@
+"""
+Local work queue for CSV ingestion.
+
+Jobs ({csv_url, mode}) are stored in a SQLite file or in an `ingest_job`
+table in PostgreSQL. IngestWorker takes a writer slot, claims jobs in
+batches, loads small files together in one transaction and retries failed
+jobs with exponential backoff. At most max_writers workers write at once,
+each on a single connection.
+
+Usage:
+    python ingest_queue.py init  # Once per deploy: creates the PostgreSQL job table
+    python ingest_queue.py enqueue <csv_url> [--mode delta]
+    python ingest_queue.py work [--forever]
+    python ingest_queue.py status <job_id>
+
+INGEST_QUEUE selects the backend: 'sqlite:///<path>' (the default, in /tmp)
+or 'postgres' for a table in the ingestion database, which lets every Lambda
+container share one queue. Under AWS Lambda the queue must be 'postgres'
+(the default there): a container's /tmp is invisible to every other container.
+"""
+import abc
+import argparse
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from urllib.error import HTTPError
+
+import aws_lambda_parser
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE = 'sqlite:////tmp/fihub_ingest_queue.sqlite3'
+
+# Key for the PostgreSQL advisory locks that act as writer slots
+WRITER_LOCK_KEY = 0x46494855  # 'FIHU'
+
+JOB_FIELDS = ['id', 'csv_url', 'mode', 'status', 'attempts', 'next_run_at', 'lease_expires_at',
+              'last_error', 'result', 'created_at', 'updated_at']
+
+
+class QueueFull(Exception):
+    """
+    Raised by enqueue() when too many jobs are already waiting; callers should retry later.
+    """
+
+
+class JobQueue(abc.ABC):
+    """
+    Job table operations shared by the SQLite and PostgreSQL backends.
+
+    Statuses: queued -> running -> done, or back to queued with a later
+    next_run_at after a failure, or failed once max attempts are used up.
+    A running job whose lease expires (its worker died) is claimable again.
+    """
+    placeholder = '%s'
+    id_column = 'BIGSERIAL PRIMARY KEY'
+
+    def __init__(self, max_pending=1000):
+        self.max_pending = max_pending
+
+    def _sql(self, sql):
+        return sql.replace('%s', self.placeholder)
+
+    @abc.abstractmethod
+    def _execute(self, sql, params=()):
+        """
+        Runs one statement in its own transaction and returns the fetched rows (an empty list when there are none).
+        """
+
+    @contextmanager
+    def connection(self, conn=None):
+        """
+        Runs the queue operations inside the block on one database connection.
+        Only PostgresJobQueue uses it; `conn` lends an open connection instead of opening one.
+        """
+        yield conn
+
+    def ensure_schema(self):
+        self._execute(f"""
+            CREATE TABLE IF NOT EXISTS ingest_job (
+                id {self.id_column},
+                csv_url TEXT NOT NULL,
+                mode VARCHAR(16) NOT NULL,
+                status VARCHAR(16) NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_run_at DOUBLE PRECISION NOT NULL,
+                lease_expires_at DOUBLE PRECISION,
+                last_error TEXT,
+                result TEXT,
+                created_at DOUBLE PRECISION NOT NULL,
+                updated_at DOUBLE PRECISION NOT NULL
+            )
+        """)
+        self._execute("CREATE INDEX IF NOT EXISTS ingest_job_ready_idx ON ingest_job (status, next_run_at)")
+
+    def pending_count(self):
+        return self._execute("SELECT COUNT(*) FROM ingest_job WHERE status IN ('queued', 'running')")[0][0]
+
+    def enqueue(self, csv_url, mode='insert'):
+        """
+        Adds a job and returns its id. Raises QueueFull when max_pending jobs are waiting (backpressure).
+        """
+        if mode not in ('insert', 'delta'):
+            raise ValueError(f"Unsupported ingest mode: {mode}")
+        with self.connection():  # Count and insert on one connection
+            if self.pending_count() >= self.max_pending:
+                raise QueueFull(f"Ingestion queue is full ({self.max_pending} pending jobs), retry later")
+            return self._insert_job(csv_url, mode, time.time())
+
+    @abc.abstractmethod
+    def _insert_job(self, csv_url, mode, now):
+        """
+        Inserts a queued job and returns its id.
+        """
+
+    @abc.abstractmethod
+    def claim(self, limit, lease_seconds):
+        """
+        Marks up to `limit` runnable jobs as running and returns them as dicts.
+        """
+
+    def complete(self, job_id, result):
+        self._execute("""
+            UPDATE ingest_job SET status = 'done', result = %s, last_error = NULL,
+                lease_expires_at = NULL, updated_at = %s
+            WHERE id = %s
+        """, (json.dumps(result), time.time(), job_id))
+
+    def fail(self, job_id, error, retry_at=None):
+        """
+        Records a failed attempt: requeues the job for retry_at, or marks it failed when retry_at is None.
+        """
+        now = time.time()
+        if retry_at is None:
+            self._execute("""
+                UPDATE ingest_job SET status = 'failed', last_error = %s, lease_expires_at = NULL, updated_at = %s
+                WHERE id = %s
+            """, (error, now, job_id))
+        else:
+            self._execute("""
+                UPDATE ingest_job SET status = 'queued', last_error = %s, next_run_at = %s,
+                    lease_expires_at = NULL, updated_at = %s
+                WHERE id = %s
+            """, (error, retry_at, now, job_id))
+
+    def get(self, job_id):
+        """
+        Returns a job as a dict (result decoded from JSON), or None if it does not exist.
+        """
+        rows = self._execute(f"SELECT {', '.join(JOB_FIELDS)} FROM ingest_job WHERE id = %s", (job_id,))
+        if not rows:
+            return None
+        job = dict(zip(JOB_FIELDS, rows[0]))
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+
+class SQLiteJobQueue(JobQueue):
+    """
+    Queue stored in a local SQLite file; coordinates workers on one machine or container.
+    """
+    placeholder = '?'
+    id_column = 'INTEGER PRIMARY KEY AUTOINCREMENT'
+
+    def __init__(self, path, max_pending=1000):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        super().__init__(max_pending)
+        self.ensure_schema()  # A local file, so creating the table on open is cheap
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(self._sql(sql), params).fetchall()
+
+    def _insert_job(self, csv_url, mode, now):
+        with self._lock:
+            cur = self._conn.execute(self._sql("""
+                INSERT INTO ingest_job (csv_url, mode, status, next_run_at, created_at, updated_at)
+                VALUES (%s, %s, 'queued', %s, %s, %s)
+            """), (csv_url, mode, now, now, now))
+            return cur.lastrowid
+
+    def claim(self, limit, lease_seconds):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")  # Serializes claims across processes sharing the file
+            try:
+                rows = self._conn.execute(self._sql("""
+                    SELECT id, csv_url, mode, attempts FROM ingest_job
+                    WHERE (status = 'queued' AND next_run_at <= %s)
+                       OR (status = 'running' AND lease_expires_at < %s)
+                    ORDER BY id LIMIT %s
+                """), (now, now, limit)).fetchall()
+                self._conn.executemany(self._sql("""
+                    UPDATE ingest_job SET status = 'running', attempts = attempts + 1,
+                        lease_expires_at = %s, updated_at = %s
+                    WHERE id = %s
+                """), [(now + lease_seconds, now, row[0]) for row in rows])
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [{'id': id, 'csv_url': csv_url, 'mode': mode, 'attempts': attempts + 1}
+                for id, csv_url, mode, attempts in rows]
+
+
+class PostgresJobQueue(JobQueue):
+    """
+    Queue stored in an `ingest_job` table; SKIP LOCKED lets any number of workers claim concurrently.
+
+    The queue holds no connection of its own. Each operation runs on a
+    short-lived connection that is closed right after, unless a worker lent
+    its writer connection with connection(conn). Create the table once per
+    deploy with `python ingest_queue.py init`, not on every Lambda call.
+    """
+
+    def __init__(self, connect=aws_lambda_parser.get_connection, max_pending=1000):
+        self.connect = connect
+        self._local = threading.local()  # Connection the current thread's queue operations run on, if any
+        super().__init__(max_pending)
+
+    @contextmanager
+    def connection(self, conn=None):
+        current = getattr(self._local, 'conn', None)
+        if current is not None:  # Nested inside another connection() block
+            yield current
+            return
+        opened = conn is None
+        self._local.conn = conn = self.connect() if opened else conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            if opened:
+                conn.close()
+
+    def _execute(self, sql, params=()):
+        with self.connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(sql, params)
+                    rows = cur.fetchall() if cur.description else []
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        return rows
+
+    def _insert_job(self, csv_url, mode, now):
+        return self._execute("""
+            INSERT INTO ingest_job (csv_url, mode, status, next_run_at, created_at, updated_at)
+            VALUES (%s, %s, 'queued', %s, %s, %s)
+            RETURNING id
+        """, (csv_url, mode, now, now, now))[0][0]
+
+    def claim(self, limit, lease_seconds):
+        now = time.time()
+        rows = self._execute("""
+            UPDATE ingest_job SET status = 'running', attempts = attempts + 1,
+                lease_expires_at = %s, updated_at = %s
+            WHERE id IN (
+                SELECT id FROM ingest_job
+                WHERE (status = 'queued' AND next_run_at <= %s)
+                   OR (status = 'running' AND lease_expires_at < %s)
+                ORDER BY id LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, csv_url, mode, attempts
+        """, (now + lease_seconds, now, now, now, limit))
+        return [{'id': id, 'csv_url': csv_url, 'mode': mode, 'attempts': attempts}
+                for id, csv_url, mode, attempts in sorted(rows)]
+
+
+def is_permanent_error(exc):
+    """
+    True for errors caused by the job itself (bad data, unsupported file, URL
+    rejected by the server), which fail the same way on every attempt.
+
+    Covers parsing errors (ValueError, KeyError, ArithmeticError such as
+    decimal.InvalidOperation), HTTP 4xx responses other than 429, and
+    PostgreSQL data exceptions and integrity violations (SQLSTATE classes 22 and 23).
+    Connection problems, timeouts and other database errors are retried.
+    """
+    if isinstance(exc, HTTPError):
+        return 400 <= exc.code < 500 and exc.code != 429
+    if isinstance(exc, (ValueError, KeyError, ArithmeticError)):
+        return True
+    pgcode = getattr(exc, 'pgcode', None) or ''  # psycopg2 errors, without importing psycopg2 here
+    return pgcode[:2] in ('22', '23')
+
+
+def is_runnable(job, now=None):
+    """
+    True when a claim would pick the job up now: queued and due, or running with an expired lease.
+    """
+    now = time.time() if now is None else now
+    if job['status'] == 'queued':
+        return job['next_run_at'] <= now
+    return job['status'] == 'running' and job['lease_expires_at'] < now
+
+
+def default_queue():
+    """
+    Builds the queue selected by the INGEST_QUEUE environment variable.
+    Under AWS Lambda only the shared 'postgres' queue is allowed, and it is the default.
+    """
+    on_lambda = bool(os.environ.get('AWS_LAMBDA_FUNCTION_NAME'))
+    url = os.environ.get('INGEST_QUEUE', 'postgres' if on_lambda else DEFAULT_QUEUE)
+    max_pending = int(os.environ.get('INGEST_MAX_PENDING', 1000))
+    if url == 'postgres':
+        return PostgresJobQueue(max_pending=max_pending)
+    if on_lambda:
+        raise ValueError(f"INGEST_QUEUE must be 'postgres' on AWS Lambda, not {url}: "
+                         "jobs in one container's /tmp are never seen or drained by the others")
+    if url.startswith('sqlite:///'):
+        return SQLiteJobQueue(url[len('sqlite:///'):], max_pending=max_pending)
+    raise ValueError(f"Unsupported INGEST_QUEUE: {url}")
+
+
+class IngestWorker:
+    """
+    Drains an ingestion queue into PostgreSQL.
+
+    Args:
+        queue: JobQueue to claim jobs from.
+        connect: Callable returning a new psycopg2 connection.
+        max_writers: Maximum concurrent writers across all workers sharing the
+            database, enforced with advisory-lock slots. Each worker writes on
+            one connection; run several workers to write in parallel.
+        batch_rows: Files are grouped into one transaction until they reach this many rows.
+        claim_size: Jobs claimed per round.
+        max_attempts: Attempts before a job is marked failed.
+        backoff_base, backoff_max: Retry delay in seconds is
+            min(backoff_max, backoff_base * 2 ** (attempts - 1)), with jitter.
+        lease_seconds: How long a claimed job stays hidden from other workers.
+    """
+
+    def __init__(self, queue, connect=aws_lambda_parser.get_connection, max_writers=None, batch_rows=5000,
+                 claim_size=10, max_attempts=5, backoff_base=5.0, backoff_max=300.0, lease_seconds=900):
+        self.queue = queue
+        self.connect = connect
+        self.max_writers = max_writers or int(os.environ.get('INGEST_MAX_WRITERS', 2))
+        self.batch_rows = batch_rows
+        self.claim_size = claim_size
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lease_seconds = lease_seconds
+
+    def _retry_at(self, attempts):
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+        return time.time() + delay * random.uniform(0.5, 1.0)  # Jitter spreads retries of a failed burst
+
+    def _fail(self, job, error, exc=None):
+        """
+        Requeues the job with backoff, or marks it failed when its attempts are
+        used up or `exc` is a permanent error that a retry would only repeat.
+        """
+        permanent = exc is not None and is_permanent_error(exc)
+        retry = not permanent and job['attempts'] < self.max_attempts
+        retry_at = self._retry_at(job['attempts']) if retry else None
+        logger.error(f"Ingest job {job['id']} attempt {job['attempts']} failed"
+                     f"{' permanently' if permanent else ''}: {error}")
+        self.queue.fail(job['id'], error, retry_at)
+
+    def _acquire_writer_slot(self, conn):
+        """
+        Takes one of max_writers session advisory locks on the connection.
+        Returns False if all slots are held; locks are released when the connection closes.
+        """
+        with conn.cursor() as cur:
+            for slot in range(self.max_writers):
+                cur.execute("SELECT pg_try_advisory_lock(%s, %s)", (WRITER_LOCK_KEY, slot))
+                if cur.fetchone()[0]:
+                    return True
+        return False
+
+    def _load_batches(self, jobs):
+        """
+        Fetches and cleans each job's CSV and yields the files in batches of about batch_rows rows.
+        Jobs whose file cannot be loaded are failed here and left out.
+
+        Files are fetched lazily, between batch transactions, so each one is
+        downloaded once, by the worker that holds a writer slot for it.
+        """
+        batch, batch_rows = [], 0
+        for job in jobs:
+            try:
+                csv_data = aws_lambda_parser.load_csv(job['csv_url'])
+            except Exception as e:
+                self._fail(job, f"Could not load CSV: {str(e)}", e)
+                continue
+            if batch and batch_rows + len(csv_data) > self.batch_rows:
+                yield batch
+                batch, batch_rows = [], 0
+            batch.append((job, csv_data))
+            batch_rows += len(csv_data)
+        if batch:
+            yield batch
+
+    def _write_batch(self, conn, batch):
+        """
+        Loads a batch of files in one transaction, each file in its own savepoint.
+
+        Job statuses are recorded after the transaction ends, because the
+        queue may be running its statements on this same connection.
+        """
+        results, failures = [], []
+        try:
+            cur = conn.cursor()
+            affected_customers, changed = set(), False
+            for job, csv_data in batch:
+                cur.execute("SAVEPOINT ingest_job")
+                try:
+                    counts = aws_lambda_parser.ingest(cur, csv_data, job['mode'])
+                except Exception as e:
+                    cur.execute("ROLLBACK TO SAVEPOINT ingest_job")
+                    logger.error(f"Ingest job {job['id']} failed: {traceback.format_exc()}")
+                    failures.append((job, str(e), e))
+                    continue
+                cur.execute("RELEASE SAVEPOINT ingest_job")
+                affected_customers.update(counts.pop('affected_customers'))
+                changed = changed or counts['changed']
+                results.append((job, counts))
+
+            if changed:
+                aws_lambda_parser.finish_ingest(cur, affected_customers)
+            conn.commit()
+            cur.close()
+        except Exception as e:
+            conn.rollback()
+            failed = {job['id'] for job, _, _ in failures}  # Already recorded, possibly as permanent failures
+            failures += [(job, f"Batch commit failed: {str(e)}", None) for job, _ in batch if job['id'] not in failed]
+            results = []
+
+        for job, error, exc in failures:
+            self._fail(job, error, exc)
+        for job, counts in results:
+            logger.info(f"Ingest job {job['id']}: {counts['message']}")
+            self.queue.complete(job['id'], counts)
+
+    def _drain(self, max_rounds=None):
+        """
+        Takes a writer slot, then claims and writes jobs until none are runnable (or max_rounds claims).
+
+        Everything runs on one connection, which the queue borrows for its
+        own statements. Jobs are only claimed once the slot is held, so a
+        worker that finds every slot busy leaves the queue untouched.
+        Returns the number of jobs claimed, or None when no writer slot could be taken.
+        """
+        try:
+            conn = self.connect()
+        except Exception as e:
+            logger.error(f"Could not connect: {str(e)}")
+            return None
+
+        try:
+            if not self._acquire_writer_slot(conn):
+                return None
+            conn.commit()  # The session advisory lock outlives the transaction
+            claimed, rounds = 0, 0
+            with self.queue.connection(conn):
+                while max_rounds is None or rounds < max_rounds:
+                    jobs = self.queue.claim(self.claim_size, self.lease_seconds)
+                    if not jobs:
+                        break
+                    for batch in self._load_batches(jobs):
+                        self._write_batch(conn, batch)
+                    claimed += len(jobs)
+                    rounds += 1
+            return claimed
+        finally:
+            conn.close()  # Also releases the writer slot
+
+    def run_once(self):
+        """
+        Claims and writes one round of jobs. Returns the number of jobs claimed.
+        """
+        return self._drain(max_rounds=1) or 0
+
+    def run_until_idle(self):
+        """
+        Processes jobs until none are runnable right now (queued retries wait for their next_run_at).
+        Returns the number of jobs claimed, or None when every writer slot was busy.
+        """
+        return self._drain()
+
+    def run_forever(self, poll_interval=2.0):
+        while True:
+            if not self.run_until_idle():
+                time.sleep(poll_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local ingestion queue")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('init', help="Create the job table; run once per deploy")
+    enqueue = subparsers.add_parser('enqueue', help="Queue a CSV URL")
+    enqueue.add_argument('csv_url')
+    enqueue.add_argument('--mode', choices=['insert', 'delta'], default='insert')
+    work = subparsers.add_parser('work', help="Process queued jobs")
+    work.add_argument('--forever', action='store_true', help="Keep polling instead of exiting when idle")
+    status = subparsers.add_parser('status', help="Show a job")
+    status.add_argument('job_id', type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    queue = default_queue()
+    if args.command == 'init':
+        queue.ensure_schema()
+    elif args.command == 'enqueue':
+        print(queue.enqueue(args.csv_url, args.mode))
+    elif args.command == 'work':
+        worker = IngestWorker(queue)
+        worker.run_forever() if args.forever else worker.run_until_idle()
+    else:
+        print(json.dumps(queue.get(args.job_id), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+import datetime
+import hashlib
+import logging
+import threading
+import numpy as np
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from mains import snapshot_files
+from mains.dataversion import get_data_version
+from mains.models import Order
+from mains.money import from_paise
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime.date(1970, 1, 1)
+
+# Columns whose values are codes into OrderSnapshot.dictionaries (-1 means NULL)
+ENCODED_COLUMNS = ('category', 'delivery_status', 'platform')
+
+
+def to_days(value):
+    """
+    Converts a date or 'YYYY-MM-DD' string into days since the epoch.
+    """
+    if isinstance(value, str):
+        value = datetime.date.fromisoformat(value)
+    return (value - EPOCH).days
+
+
+def stable_hash(value):
+    """
+    64-bit hash of a string that is the same in every process (unlike hash()).
+    """
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def month_start(month_index):
+    """
+    Converts months since January 1970 back into the first day of that month.
+    """
+    year, month = divmod(int(month_index), 12)
+    return datetime.date(1970 + year, month + 1, 1)
+
+
+class OrderSnapshot:
+    """
+    Columnar in-memory copy of Order joined with Delivery and Platform.
+
+    Dates are int32 days since the epoch, prices are int64 paise and category,
+    delivery status and platform are int32 codes into per-column dictionaries.
+    Customer and product IDs are kept only as uint64 hashes for distinct-count sketches.
+    """
+
+    def __init__(self, version, columns, dictionaries):
+        self.version = version
+        self.columns = columns  # Column name -> 1-D NumPy array, all the same length
+        self.dictionaries = dictionaries  # Encoded column name -> list of distinct values
+        self._codes = {name: {value: code for code, value in enumerate(values)}
+                       for name, values in dictionaries.items()}
+
+    def __len__(self):
+        return len(self.columns['date_of_sale'])
+
+    @classmethod
+    def from_database(cls, version):
+        """
+        Builds a snapshot with a single pass over the order table.
+
+        Always reads the primary, which the data version it is stamped with comes from.
+        """
+        rows = Order.objects.using(DEFAULT_DB_ALIAS).values_list(
+            'date_of_sale', 'category', 'delivery__delivery_status',
+            'platform__platform_name', 'quantity_sold', 'selling_price_paise', 'customer_id', 'product_id',
+        ).iterator(chunk_size=10000)
+
+        dictionaries = {name: [] for name in ENCODED_COLUMNS}
+        codes = {name: {} for name in ENCODED_COLUMNS}
+        values = {name: [] for name in ('date_of_sale', 'quantity_sold', 'selling_price',
+                                        'customer_hash', 'product_hash') + ENCODED_COLUMNS}
+        hashes = {}  # Customers and products repeat across orders, so hash each ID once
+
+        for (date_of_sale, category, delivery_status, platform, quantity_sold, selling_price_paise,
+             customer_id, product_id) in rows:
+            values['date_of_sale'].append(to_days(date_of_sale))
+            values['quantity_sold'].append(quantity_sold)
+            values['selling_price'].append(selling_price_paise)  # Already integer paise
+            for name, value in (('customer_hash', customer_id), ('product_hash', product_id)):
+                if value not in hashes:
+                    hashes[value] = stable_hash(value)
+                values[name].append(hashes[value])
+            for name, value in zip(ENCODED_COLUMNS, (category, delivery_status, platform)):
+                if value is None:
+                    values[name].append(-1)
+                    continue
+                code = codes[name].get(value)
+                if code is None:
+                    code = codes[name][value] = len(dictionaries[name])
+                    dictionaries[name].append(value)
+                values[name].append(code)
+
+        dates = np.array(values['date_of_sale'], dtype=np.int32)
+        columns = {
+            'date_of_sale': dates,
+            'month': dates.astype('datetime64[D]').astype('datetime64[M]').astype(np.int32),
+            'quantity_sold': np.array(values['quantity_sold'], dtype=np.int32),
+            'selling_price': np.array(values['selling_price'], dtype=np.int64),
+            'customer_hash': np.array(values['customer_hash'], dtype=np.uint64),
+            'product_hash': np.array(values['product_hash'], dtype=np.uint64),
+        }
+        for name in ENCODED_COLUMNS:
+            columns[name] = np.array(values[name], dtype=np.int32)
+        return cls(version, columns, dictionaries)
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Maps a snapshot written by snapshot_files.write_snapshot() without copying it into memory.
+        """
+        version, columns, dictionaries = snapshot_files.read_snapshot(path)
+        return cls(version, columns, dictionaries)
+
+    def code(self, name, value):
+        """
+        Returns the code of a value in an encoded column, or -2 (matches no row) if it never occurs.
+        """
+        return self._codes[name].get(value, -2)
+
+    def mask(self, start_date=None, end_date=None, category=None, delivery_status=None, platform=None):
+        """
+        Returns a boolean row mask for the same filters the views accept.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if start_date:
+            mask &= self.columns['date_of_sale'] >= to_days(start_date)
+        if end_date:
+            mask &= self.columns['date_of_sale'] <= to_days(end_date)
+        for name, value in (('category', category), ('delivery_status', delivery_status), ('platform', platform)):
+            if value:
+                mask &= self.columns[name] == self.code(name, value)  # Unknown values match nothing
+        return mask
+
+    def monthly_totals(self, **filters):
+        """
+        Returns total quantity and revenue per month, ordered by month.
+        """
+        mask = self.mask(**filters)
+        months, index = np.unique(self.columns['month'][mask], return_inverse=True)
+        quantity = self.columns['quantity_sold'][mask].astype(np.int64)
+        revenue = quantity * self.columns['selling_price'][mask]
+
+        total_quantity = np.zeros(len(months), dtype=np.int64)
+        total_revenue = np.zeros(len(months), dtype=np.int64)
+        np.add.at(total_quantity, index, quantity)
+        np.add.at(total_revenue, index, revenue)
+
+        return [
+            {
+                'month': month_start(month),
+                'total_quantity': int(quantity_sum),
+                'total_revenue_paise': int(revenue_sum),
+            }
+            for month, quantity_sum, revenue_sum in zip(months, total_quantity, total_revenue)
+        ]
+
+    def summary(self, **filters):
+        """
+        Returns the same metrics as the summary_metrics view.
+        """
+        mask = self.mask(**filters)
+        quantity = self.columns['quantity_sold'][mask].astype(np.int64)
+        total_revenue = int(np.dot(quantity, self.columns['selling_price'][mask]))
+        total_orders = int(mask.sum())
+
+        cancelled_code = self.code('delivery_status', 'Cancelled')
+        total_cancelled_orders = int(np.count_nonzero(self.columns['delivery_status'][mask] == cancelled_code))
+
+        return {
+            'total_revenue': from_paise(total_revenue),
+            'total_orders': total_orders,
+            'total_products_sold': int(quantity.sum()),
+            'canceled_order_percentage': (total_cancelled_orders / total_orders) * 100 if total_orders else 0,
+        }
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()  # Guards _snapshot and _refreshing
+_cold_start_lock = threading.Lock()
+_refreshing = None  # Data version being loaded by the background thread, if any
+
+
+def load_snapshot(version):
+    """
+    Returns the snapshot for a data version, from ANALYTICS_SNAPSHOT_DIR when it is set.
+
+    A missing file is built from the database once per host and written for
+    the other workers, which then map the same pages.
+    """
+    directory = settings.ANALYTICS_SNAPSHOT_DIR
+    if not directory:
+        return OrderSnapshot.from_database(version)
+
+    path = snapshot_files.snapshot_path(directory, version)
+    if path.exists():
+        try:
+            return OrderSnapshot.from_file(path)
+        except FileNotFoundError:
+            pass  # Pruned by a newer write_snapshot() since exists(); rebuild it below
+        except snapshot_files.SnapshotFormatError:
+            pass  # Left behind by an older release; rebuild it below
+
+    with snapshot_files.build_lock(directory):
+        try:
+            return OrderSnapshot.from_file(path)  # Another worker may have written it while we waited
+        except (FileNotFoundError, snapshot_files.SnapshotFormatError):
+            snapshot_files.write_snapshot(
+                OrderSnapshot.from_database(version), directory, keep=settings.ANALYTICS_SNAPSHOT_KEEP
+            )
+    return OrderSnapshot.from_file(path)
+
+
+def refresh_snapshot(version):
+    """
+    Loads the snapshot for a data version and makes it the one get_snapshot() serves.
+    """
+    global _snapshot
+
+    snapshot = load_snapshot(version)
+    with _snapshot_lock:
+        _snapshot = snapshot
+    return snapshot
+
+
+def _refresh_in_background(version):
+    global _refreshing
+
+    try:
+        refresh_snapshot(version)
+    except Exception:
+        logger.exception(f"Could not load the analytics snapshot for data version {version}")
+    finally:
+        connections.close_all()  # Only closes this thread's connections
+        with _snapshot_lock:
+            _refreshing = None
+
+
+def get_snapshot():
+    """
+    Returns the snapshot for the current data version.
+
+    When ingestion has bumped the version, the previous snapshot keeps being
+    served while a background thread loads the new one (mapping the file that
+    build_analytics_snapshot wrote, or building it), so requests never wait on
+    a rebuild. Only the first call in a process loads synchronously.
+    """
+    global _refreshing
+
+    version, _ = get_data_version()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+
+    if snapshot is None:
+        with _cold_start_lock:
+            if _snapshot is None:  # Another thread may have loaded it while we waited
+                refresh_snapshot(version)
+        return _snapshot
+
+    with _snapshot_lock:
+        if _refreshing is None:
+            _refreshing = version
+            threading.Thread(target=_refresh_in_background, args=(version,), daemon=True,
+                             name='analytics-snapshot').start()
+    return snapshot
@@ -0,0 +1,190 @@
+import threading
+import numpy as np
+from django.conf import settings
+
+from mains.analytics import OrderSnapshot, get_snapshot, month_start, to_days
+from mains.money import from_paise
+from mains.sketches import HyperLogLog, grouped_hyperloglogs, grouped_reservoir_sample
+
+# Multiplier for the standard error that gives a ~95% confidence half-width
+Z_95 = 1.96
+
+
+def _stratified_total(y, strata, population, sample_size):
+    """
+    Estimates a population total from a sample stratified by month.
+
+    Args:
+        y: Per-sample values, already zeroed for rows outside the filter.
+        strata: Stratum (month) index of each sample row.
+        population: Number of rows in each stratum.
+        sample_size: Number of sampled rows in each stratum.
+
+    Returns:
+        (estimates, variances) per stratum, so callers can report per month or sum them.
+    """
+    n_strata = len(population)
+    sums = np.zeros(n_strata)
+    squares = np.zeros(n_strata)
+    np.add.at(sums, strata, y)
+    np.add.at(squares, strata, y * y)
+
+    n = np.maximum(sample_size, 1)
+    mean = sums / n
+    sample_variance = np.where(sample_size > 1, (squares - n * mean ** 2) / np.maximum(n - 1, 1), 0.0)
+    finite_population = 1 - sample_size / np.maximum(population, 1)  # 0 when the whole month is sampled
+    estimates = population * mean
+    variances = population ** 2 * finite_population * np.maximum(sample_variance, 0) / n
+    return estimates, variances
+
+
+class ApproxIndex:
+    """
+    Per-month samples and sketches over an OrderSnapshot for approximate analytics.
+
+    Each month keeps a uniform sample of at most ANALYTICS_SAMPLE_SIZE orders
+    plus HyperLogLog registers for its customers and products. Totals are
+    stratified estimates from the samples; distinct counts merge the monthly
+    sketches. Error bounds are ~95% confidence half-widths.
+    """
+
+    def __init__(self, snapshot, sample_size, precision):
+        self.snapshot = snapshot
+        self.version = snapshot.version
+        self.precision = precision
+
+        self.months, month_index = np.unique(snapshot.columns['month'], return_inverse=True)
+        self.population = np.bincount(month_index, minlength=len(self.months)).astype(np.float64)
+
+        rows = grouped_reservoir_sample(month_index, sample_size, seed=snapshot.version)
+        self.sample = OrderSnapshot(  # Compact copy so filters only touch sampled rows
+            snapshot.version, {name: column[rows] for name, column in snapshot.columns.items()}, snapshot.dictionaries)
+        self.sample_strata = month_index[rows]
+        self.sample_size = np.bincount(self.sample_strata, minlength=len(self.months)).astype(np.float64)
+
+        self.customer_registers = grouped_hyperloglogs(
+            month_index, len(self.months), snapshot.columns['customer_hash'], precision)
+        self.product_registers = grouped_hyperloglogs(
+            month_index, len(self.months), snapshot.columns['product_hash'], precision)
+
+    def _sample_values(self, mask):
+        columns = self.sample.columns
+        quantity = columns['quantity_sold'].astype(np.float64) * mask
+        revenue = quantity * columns['selling_price']
+        return quantity, revenue
+
+    def monthly_totals(self, **filters):
+        """
+        Estimated quantity and revenue per month, with error bounds.
+        """
+        mask = self.sample.mask(**filters)
+        quantity, revenue = self._sample_values(mask)
+        args = (self.sample_strata, self.population, self.sample_size)
+        quantity_total, quantity_variance = _stratified_total(quantity, *args)
+        revenue_total, revenue_variance = _stratified_total(revenue, *args)
+        matched = np.bincount(self.sample_strata, weights=mask, minlength=len(self.months))
+
+        return [
+            {
+                'month': month_start(self.months[i]),
+                'total_quantity': int(round(quantity_total[i])),
+                'total_quantity_error': int(np.ceil(Z_95 * np.sqrt(quantity_variance[i]))),
+                'total_revenue_paise': int(round(revenue_total[i])),
+                'total_revenue_error_paise': int(np.ceil(Z_95 * np.sqrt(revenue_variance[i]))),
+            }
+            for i in range(len(self.months))
+            if matched[i]  # Like the exact query, months without matching orders are left out
+        ]
+
+    def _distinct(self, column, month_registers, filters):
+        """
+        Estimates distinct values of a hash column for the filtered orders.
+
+        Date-only filters merge whole-month sketches and sketch just the partial
+        months at the edges; any other filter sketches the matching rows directly.
+        """
+        sketch = HyperLogLog(self.precision)
+        if set(filters) - {'start_date', 'end_date'}:
+            return sketch.add_hashes(self.snapshot.columns[column][self.snapshot.mask(**filters)])
+
+        start = to_days(filters['start_date']) if filters.get('start_date') else None
+        end = to_days(filters['end_date']) if filters.get('end_date') else None
+        date_mask = None
+        for i, month in enumerate(self.months):
+            month_first = np.datetime64(int(month), 'M').astype('datetime64[D]').astype(np.int64)
+            month_last = np.datetime64(int(month) + 1, 'M').astype('datetime64[D]').astype(np.int64) - 1
+            if (start is not None and month_last < start) or (end is not None and month_first > end):
+                continue
+            if (start is None or start <= month_first) and (end is None or month_last <= end):
+                np.maximum(sketch.registers, month_registers[i], out=sketch.registers)
+            else:
+                if date_mask is None:
+                    date_mask = self.snapshot.mask(**filters)
+                rows = date_mask & (self.snapshot.columns['month'] == month)
+                sketch.add_hashes(self.snapshot.columns[column][rows])
+        return sketch
+
+    def summary(self, **filters):
+        """
+        Estimated summary metrics plus distinct customers and products, with error bounds.
+        """
+        mask = self.sample.mask(**filters)
+        quantity, revenue = self._sample_values(mask)
+        cancelled = mask & (self.sample.columns['delivery_status'] == self.sample.code('delivery_status', 'Cancelled'))
+
+        args = (self.sample_strata, self.population, self.sample_size)
+        orders, orders_variance = (a.sum() for a in _stratified_total(mask.astype(np.float64), *args))
+        products, products_variance = (a.sum() for a in _stratified_total(quantity, *args))
+        revenue_total, revenue_variance = (a.sum() for a in _stratified_total(revenue, *args))
+
+        # Cancelled share is a ratio estimate; its variance comes from the residuals cancelled - ratio * matched
+        ratio = 0.0
+        ratio_variance = 0.0
+        if orders:
+            cancelled_total = _stratified_total(cancelled.astype(np.float64), *args)[0].sum()
+            ratio = cancelled_total / orders
+            residual_variance = _stratified_total(cancelled - ratio * mask, *args)[1].sum()
+            ratio_variance = residual_variance / orders ** 2
+
+        customers = self._distinct('customer_hash', self.customer_registers, filters)
+        product_ids = self._distinct('product_hash', self.product_registers, filters)
+
+        def error(variance):
+            return Z_95 * float(np.sqrt(variance))
+
+        return {
+            'approximate': True,
+            'total_revenue': from_paise(revenue_total),
+            'total_revenue_error': from_paise(np.ceil(error(revenue_variance))),
+            'total_orders': int(round(orders)),
+            'total_orders_error': int(np.ceil(error(orders_variance))),
+            'total_products_sold': int(round(products)),
+            'total_products_sold_error': int(np.ceil(error(products_variance))),
+            'canceled_order_percentage': ratio * 100,
+            'canceled_order_percentage_error': error(ratio_variance) * 100,
+            'distinct_customers': int(round(customers.count())),
+            'distinct_customers_error': int(np.ceil(Z_95 * customers.relative_error * customers.count())),
+            'distinct_products': int(round(product_ids.count())),
+            'distinct_products_error': int(np.ceil(Z_95 * product_ids.relative_error * product_ids.count())),
+        }
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_approx_index():
+    """
+    Returns the approximate index for the current snapshot, rebuilding it when the data version changes.
+    """
+    global _index
+
+    snapshot = get_snapshot()
+    index = _index
+    if index is not None and index.version == snapshot.version:
+        return index
+
+    with _index_lock:
+        if _index is None or _index.version != snapshot.version:
+            _index = ApproxIndex(snapshot, settings.ANALYTICS_SAMPLE_SIZE, settings.ANALYTICS_HLL_PRECISION)
+        return _index
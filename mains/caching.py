@@ -0,0 +1,76 @@
+from functools import wraps
+
+from django.conf import settings
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from mains.dataversion import get_data_version
+
+
+def wants_approx(request):
+    """
+    True when the request asks for approximate results (approx=true).
+    """
+    return request.GET.get('approx', '').lower() == 'true'
+
+
+def snapshot_data_version(request):
+    """
+    Returns (version, updated_at) of the data a snapshot-backed view will answer from.
+
+    Requests answered from the in-memory snapshot (ANALYTICS_BACKEND=memory
+    or approx=true) may still get the previous snapshot while the new one
+    loads; their validators must describe that snapshot, not the database.
+    """
+    if hasattr(request, '_snapshot_data_version'):  # ETag and Last-Modified must describe the same data
+        return request._snapshot_data_version
+
+    version, updated_at = get_data_version()
+    if settings.ANALYTICS_BACKEND == 'memory' or wants_approx(request):
+        from mains.analytics import get_snapshot  # numpy is only imported when a snapshot answers
+
+        snapshot_version = get_snapshot().version
+        if snapshot_version != version:
+            updated_at = None  # The previous snapshot's modification time is not known
+        version = snapshot_version
+    request._snapshot_data_version = (version, updated_at)
+    return version, updated_at
+
+
+def _conditional(version_func):
+    def etag(request, *args, **kwargs):
+        version, _ = version_func(request)
+        return f'"data-{version}"'
+
+    def last_modified(request, *args, **kwargs):
+        _, updated_at = version_func(request)
+        return updated_at
+
+    def decorator(view):
+        conditional_view = condition(etag_func=etag, last_modified_func=last_modified)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            patch_cache_control(response, no_cache=True)
+            return response
+        return wrapper
+    return decorator
+
+
+def data_version_conditional(view):
+    """
+    View decorator adding ETag and Last-Modified headers derived from the ingestion data version.
+
+    Requests whose If-None-Match / If-Modified-Since still match get a 304
+    before the view runs, so an unchanged dashboard costs no analytics query.
+    Responses are marked no-cache so browsers always revalidate.
+    """
+    return _conditional(lambda request: get_data_version())(view)
+
+
+def snapshot_version_conditional(view):
+    """
+    Like data_version_conditional, for views that can answer from the analytics snapshot.
+    """
+    return _conditional(snapshot_data_version)(view)
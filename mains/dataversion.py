@@ -0,0 +1,45 @@
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import F
+from django.utils import timezone
+
+from mains.models import DataVersion
+
+# Database alias -> ((version, updated_at) of the last lookup, when it was made)
+_cached = {}
+
+
+def get_data_version(using=DEFAULT_DB_ALIAS):
+    """
+    Returns the ingestion data version of a database as a (version, updated_at) tuple.
+
+    Defaults to the primary. Each alias is cached in-process for
+    DATA_VERSION_CACHE_SECONDS, so callers can check it on every request.
+    A replica's row tells how far it has replayed the primary.
+    """
+    now = time.monotonic()
+    cached = _cached.get(using)
+    if cached is None or now - cached[1] > settings.DATA_VERSION_CACHE_SECONDS:
+        row = (
+            DataVersion.objects.using(using)
+            .filter(pk=1)
+            .values_list('version', 'updated_at')
+            .first()
+        )
+        cached = _cached[using] = (row or (0, None), now)
+    return cached[0]
+
+
+def bump_data_version():
+    """
+    Increments the data version after a write made through Django
+    (the Lambda parser bumps it with plain SQL instead).
+    """
+    updated = DataVersion.objects.using(DEFAULT_DB_ALIAS).filter(pk=1).update(
+        version=F('version') + 1, updated_at=timezone.now()
+    )
+    if not updated:
+        DataVersion.objects.using(DEFAULT_DB_ALIAS).create(pk=1, version=1)
+    _cached.pop(DEFAULT_DB_ALIAS, None)  # Force the next lookup to hit the database
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from mains import snapshot_files
+from mains.analytics import OrderSnapshot
+from mains.dataversion import get_data_version
+
+
+class Command(BaseCommand):
+    help = "Writes the memory-mapped analytics snapshot for the current data version. Run after ingestion to warm workers."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Rebuild even if the file already exists")
+
+    def handle(self, *args, **options):
+        directory = settings.ANALYTICS_SNAPSHOT_DIR
+        if not directory:
+            raise CommandError("ANALYTICS_SNAPSHOT_DIR is not set")
+
+        version, _ = get_data_version()
+        path = snapshot_files.snapshot_path(directory, version)
+        if path.exists() and not options['force']:
+            self.stdout.write(f"Snapshot for data version {version} already exists: {path}")
+            return
+
+        with snapshot_files.build_lock(directory):
+            snapshot = OrderSnapshot.from_database(version)
+            path = snapshot_files.write_snapshot(snapshot, directory, keep=settings.ANALYTICS_SNAPSHOT_KEEP)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(snapshot)} rows for data version {version} to {path}"))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from mains.dataversion import bump_data_version
+from mains.rollups import refresh_customer_rollups
+
+
+class Command(BaseCommand):
+    help = "Recomputes order count, lifetime revenue, sale dates and platforms for every customer."
+
+    def handle(self, *args, **options):
+        updated = refresh_customer_rollups()
+        bump_data_version()
+        self.stdout.write(self.style.SUCCESS(f"Refreshed rollups for {updated} customers"))
@@ -0,0 +1,113 @@
+import zlib
+
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+try:
+    import zstandard  # Optional: zstd is only offered when the package is installed
+except ImportError:
+    zstandard = None
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 200
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def parse_accept_encoding(header):
+    """
+    Returns {coding: q-value} for an Accept-Encoding header, lower-cased.
+    """
+    codings = {}
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        codings[coding.strip().lower()] = q
+    return codings
+
+
+def choose_encoding(header):
+    """
+    Picks 'zstd' or 'gzip' for an Accept-Encoding header, or None for identity.
+    zstd wins ties because it is faster at a similar ratio.
+    """
+    codings = parse_accept_encoding(header)
+    wildcard = codings.get('*', 0.0)
+    gzip_q = codings.get('gzip', wildcard)
+    zstd_q = codings.get('zstd', wildcard) if zstandard is not None else 0.0
+    if zstd_q > 0 and zstd_q >= gzip_q:
+        return 'zstd'
+    if gzip_q > 0:
+        return 'gzip'
+    return None
+
+
+def _compressor(encoding):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header and trailer
+
+
+def compress_string(data, encoding):
+    compressor = _compressor(encoding)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_sequence(sequence, encoding):
+    """
+    Compresses a streaming body chunk by chunk, without buffering the whole response.
+    """
+    compressor = _compressor(encoding)
+    for chunk in sequence:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compresses responses with zstd or gzip, negotiated from Accept-Encoding.
+
+    Like django.middleware.gzip.GZipMiddleware, but also offers zstd and
+    compresses streaming responses such as the CSV export incrementally.
+    """
+
+    def process_response(self, request, response):
+        if not response.streaming and len(response.content) < MIN_COMPRESS_SIZE:
+            return response
+        if response.has_header('Content-Encoding'):  # Already compressed by the view
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_sequence(response.streaming_content, encoding)
+            del response.headers['Content-Length']
+        else:
+            compressed = compress_string(response.content, encoding)
+            if len(compressed) >= len(response.content):  # Compression did not help
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        # The compressed body differs byte for byte, so a strong ETag must become weak
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+
+        response.headers['Content-Encoding'] = encoding
+        return response
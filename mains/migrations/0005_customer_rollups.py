@@ -0,0 +1,85 @@
+# Generated by Django 4.2.18 on 2026-10-19 11:49
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count, F, Max, Min, Sum
+
+
+def backfill_customer_rollups(apps, schema_editor):
+    Customer = apps.get_model("mains", "Customer")
+    Order = apps.get_model("mains", "Order")
+    using = schema_editor.connection.alias
+
+    platforms = defaultdict(set)
+    for customer_id, platform_name in (
+        Order.objects.using(using).values_list("customer_id", "platform__platform_name").distinct()
+    ):
+        platforms[customer_id].add(platform_name)
+
+    totals = Order.objects.using(using).values("customer_id").annotate(
+        order_count=Count("order_id"),
+        lifetime_revenue=Sum(
+            F("quantity_sold") * F("selling_price"), output_field=models.DecimalField()
+        ),
+        first_sale_date=Min("date_of_sale"),
+        last_sale_date=Max("date_of_sale"),
+    ).order_by()
+    customers = [
+        Customer(
+            customer_id=row["customer_id"],
+            order_count=row["order_count"],
+            lifetime_revenue=row["lifetime_revenue"] or 0,
+            first_sale_date=row["first_sale_date"],
+            last_sale_date=row["last_sale_date"],
+            platforms=",".join(sorted(platforms[row["customer_id"]])),
+        )
+        for row in totals
+    ]
+    Customer.objects.using(using).bulk_update(
+        customers,
+        ["order_count", "lifetime_revenue", "first_sale_date", "last_sale_date", "platforms"],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mains", "0004_dataversion"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customer",
+            name="first_sale_date",
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="customer",
+            name="last_sale_date",
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="customer",
+            name="lifetime_revenue",
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name="customer",
+            name="order_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="customer",
+            name="platforms",
+            field=models.CharField(blank=True, default="", max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name="customer",
+            index=models.Index(
+                fields=["-lifetime_revenue", "customer_id"], name="customer_revenue_idx"
+            ),
+        ),
+        migrations.RunPython(backfill_customer_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 4.2.18 on 2026-10-19 15:02
+
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Cast, Round
+
+
+def rupees_to_paise(apps, schema_editor):
+    Customer = apps.get_model("mains", "Customer")
+    Order = apps.get_model("mains", "Order")
+    using = schema_editor.connection.alias
+
+    # Round before the cast so backends that store decimals as floats cannot truncate 19.99 to 1998
+    Order.objects.using(using).update(
+        selling_price_paise=Cast(Round(F("selling_price") * 100), models.BigIntegerField())
+    )
+    Customer.objects.using(using).update(
+        lifetime_revenue_paise=Cast(Round(F("lifetime_revenue") * 100), models.BigIntegerField())
+    )
+
+
+def paise_to_rupees(apps, schema_editor):
+    Customer = apps.get_model("mains", "Customer")
+    Order = apps.get_model("mains", "Order")
+    using = schema_editor.connection.alias
+
+    Order.objects.using(using).update(selling_price=F("selling_price_paise") / 100.0)
+    Customer.objects.using(using).update(lifetime_revenue=F("lifetime_revenue_paise") / 100.0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mains", "0005_customer_rollups"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="customer",
+            name="customer_revenue_idx",
+        ),
+        migrations.AddField(
+            model_name="customer",
+            name="lifetime_revenue_paise",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="selling_price_paise",
+            field=models.BigIntegerField(null=True),
+        ),
+        # Nullable while both columns exist, so the migration can be reversed
+        migrations.AlterField(
+            model_name="order",
+            name="selling_price",
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.RunPython(rupees_to_paise, paise_to_rupees),
+        migrations.RemoveField(
+            model_name="customer",
+            name="lifetime_revenue",
+        ),
+        migrations.RemoveField(
+            model_name="order",
+            name="selling_price",
+        ),
+        migrations.AlterField(
+            model_name="order",
+            name="selling_price_paise",
+            field=models.BigIntegerField(),
+        ),
+        migrations.AddIndex(
+            model_name="customer",
+            index=models.Index(
+                fields=["-lifetime_revenue_paise", "customer_id"], name="customer_revenue_idx"
+            ),
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.db import models
 from django.db.models import TextChoices
 
+from mains.money import from_paise
+
 class Platform(models.Model):
     """
     Represents different e-commerce platforms (e.g., Flipkart, Amazon).
@@ -25,6 +27,19 @@ class Customer(models.Model):
     contact_email = models.EmailField(blank=True, null=True)
     phone_number = models.CharField(max_length=20, blank=True, null=True)
 
+    # Rollups over the customer's orders, maintained in bulk by the ingest path
+    order_count = models.IntegerField(default=0)
+    lifetime_revenue_paise = models.BigIntegerField(default=0)  # Integer paise, see mains.money
+    first_sale_date = models.DateField(blank=True, null=True)
+    last_sale_date = models.DateField(blank=True, null=True)
+    platforms = models.CharField(max_length=255, blank=True, default='')  # Comma-separated platform names
+
+    class Meta:
+        indexes = [
+            # Serves the top-customers leaderboard as an index range scan
+            models.Index(fields=['-lifetime_revenue_paise', 'customer_id'], name='customer_revenue_idx'),
+        ]
+
     def __str__(self):
         return self.customer_name
 
@@ -37,13 +52,20 @@ class Order(models.Model):
     product_name = models.CharField(max_length=255)
     category = models.CharField(max_length=255)
     quantity_sold = models.IntegerField()
-    selling_price = models.DecimalField(max_digits=10, decimal_places=2)
+    selling_price_paise = models.BigIntegerField()  # Integer paise, so revenue sums are exact bigint arithmetic
     date_of_sale = models.DateField()
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
     platform = models.ForeignKey(Platform, on_delete=models.CASCADE)
     coupon_used = models.BooleanField(default=False)
     return_window = models.IntegerField(null=True, blank=True)
 
+    @property
+    def selling_price(self):
+        """
+        Selling price in rupees, as a Decimal with 2 decimal places.
+        """
+        return from_paise(self.selling_price_paise)
+
     @property
     def total_sale_value(self):
         """
@@ -65,4 +87,14 @@ class Delivery(models.Model):
     delivery_partner = models.CharField(max_length=255, blank=True, null=True)
 
     def __str__(self):
-        return f"Delivery for Order ID: {self.order.order_id}"
\ No newline at end of file
+        return f"Delivery for Order ID: {self.order.order_id}"
+
+class DataVersion(models.Model):
+    """
+    Single-row counter bumped by every ingestion run that changes data.
+    """
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Data version {self.version}"
@@ -0,0 +1,19 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+# Money is stored and aggregated as integer paise; rupees only appear at the API edge
+PAISE_PER_RUPEE = 100
+CENT = Decimal('0.01')
+
+
+def to_paise(amount):
+    """
+    Converts a rupee amount (Decimal, str or int) into integer paise, rounding half up.
+    """
+    return int((Decimal(amount) * PAISE_PER_RUPEE).to_integral_value(ROUND_HALF_UP))
+
+
+def from_paise(paise):
+    """
+    Converts paise (an integer, or a database sum or average of them) into rupees with 2 decimal places.
+    """
+    return Decimal(round(paise)).scaleb(-2).quantize(CENT)
@@ -0,0 +1,61 @@
+from collections import defaultdict
+
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import BigIntegerField, Count, F, Max, Min, Sum
+
+from mains.models import Customer, Order
+
+ROLLUP_FIELDS = ['order_count', 'lifetime_revenue_paise', 'first_sale_date', 'last_sale_date', 'platforms']
+
+# Rollup values of a customer without orders
+EMPTY_ROLLUP = {'order_count': 0, 'lifetime_revenue_paise': 0, 'first_sale_date': None,
+                'last_sale_date': None, 'platforms': ''}
+
+
+def refresh_customer_rollups(customer_ids=None, using=DEFAULT_DB_ALIAS, batch_size=1000):
+    """
+    Recomputes the per-customer rollup columns from the order table.
+
+    Args:
+        customer_ids: Customers to refresh; None refreshes every customer.
+        using: Database alias to read from and write to.
+        batch_size: Rows per bulk UPDATE.
+
+    Returns:
+        Number of customers updated.
+    """
+    orders = Order.objects.using(using)
+    if customer_ids is not None:
+        orders = orders.filter(customer_id__in=customer_ids)
+
+    platforms = defaultdict(set)
+    for customer_id, platform_name in orders.values_list('customer_id', 'platform__platform_name').distinct():
+        platforms[customer_id].add(platform_name)
+
+    totals = orders.values('customer_id').annotate(
+        order_count=Count('order_id'),
+        lifetime_revenue_paise=Sum(F('quantity_sold') * F('selling_price_paise'), output_field=BigIntegerField()),
+        first_sale_date=Min('date_of_sale'),
+        last_sale_date=Max('date_of_sale'),
+    ).order_by()
+
+    customers = [
+        Customer(
+            customer_id=row['customer_id'],
+            order_count=row['order_count'],
+            lifetime_revenue_paise=row['lifetime_revenue_paise'] or 0,
+            first_sale_date=row['first_sale_date'],
+            last_sale_date=row['last_sale_date'],
+            platforms=','.join(sorted(platforms[row['customer_id']])),
+        )
+        for row in totals
+    ]
+    Customer.objects.using(using).bulk_update(customers, ROLLUP_FIELDS, batch_size=batch_size)
+
+    # Customers whose orders were all deleted or moved away have no totals row; reset them in one UPDATE
+    emptied = Customer.objects.using(using).exclude(
+        customer_id__in=Order.objects.using(using).values('customer_id'),
+    ).exclude(**EMPTY_ROLLUP)
+    if customer_ids is not None:
+        emptied = emptied.filter(customer_id__in=customer_ids)
+    return len(customers) + emptied.update(**EMPTY_ROLLUP)
@@ -0,0 +1,121 @@
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+# While an analytics view is running, the set of aliases its reads were sent to;
+# only those reads may go to the replica
+_analytics_reads = ContextVar('analytics_reads', default=None)
+
+# Monotonic time until which an unreachable replica is skipped
+_replica_down_until = 0.0
+
+
+@contextmanager
+def analytics_reads():
+    """
+    Routes ORM reads made inside the block to the analytics database.
+    """
+    token = _analytics_reads.set(set())
+    try:
+        yield
+    finally:
+        _analytics_reads.reset(token)
+
+
+def use_analytics_db(view):
+    """
+    View decorator that runs the whole view inside analytics_reads().
+
+    If a query fails after the view was routed to the replica (it accepted
+    the connection but not the query), the replica is skipped for
+    REPLICA_RETRY_SECONDS and the view runs once more on the primary.
+    Streaming bodies are read after the view returns, so a failure mid-stream is not retried.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with analytics_reads():
+            try:
+                return view(*args, **kwargs)
+            except DatabaseError as e:
+                replicas = _analytics_reads.get() - {DEFAULT_DB_ALIAS}
+                if not replicas:
+                    raise
+                for alias in replicas:
+                    _mark_replica_down(alias, e)
+        with analytics_reads():
+            return view(*args, **kwargs)
+    return wrapper
+
+
+def _mark_replica_down(alias, error):
+    global _replica_down_until
+
+    logger.warning(f"Replica '{alias}' unavailable, reading from primary: {str(error)}")
+    _replica_down_until = time.monotonic() + settings.REPLICA_RETRY_SECONDS
+
+
+def _replica_current(alias):
+    """
+    Checks that the replica is reachable and has replayed the primary's
+    latest data version, skipping it for REPLICA_RETRY_SECONDS after a failure.
+
+    The ETag and Last-Modified of analytics responses come from the primary's
+    data version, so a lagging replica must not serve the body: its stale
+    answer would be cached under the current ETag until the next ingestion.
+    """
+    if time.monotonic() < _replica_down_until:
+        return False
+
+    from mains.dataversion import get_data_version  # Imported here to avoid loading models with the router
+
+    try:
+        replica_version, _ = get_data_version(using=alias)
+    except DatabaseError as e:
+        _mark_replica_down(alias, e)
+        return False
+    primary_version, _ = get_data_version()
+    return replica_version >= primary_version
+
+
+def analytics_db_alias():
+    """
+    Returns the alias analytics reads should use right now: the configured
+    replica, or 'default' when it is missing, unreachable or behind the primary.
+    Inside analytics_reads() the choice is recorded so failed replica queries can be retried.
+    """
+    alias = getattr(settings, 'ANALYTICS_DB_ALIAS', DEFAULT_DB_ALIAS)
+    if alias == DEFAULT_DB_ALIAS or alias not in connections.databases or not _replica_current(alias):
+        alias = DEFAULT_DB_ALIAS
+    used = _analytics_reads.get()
+    if used is not None:
+        used.add(alias)
+    return alias
+
+
+class AnalyticsReplicaRouter:
+    """
+    Sends reads of the mains models made by the analytics views and exports
+    to ANALYTICS_DB_ALIAS and everything else, including all writes, to the primary.
+
+    Only the mains tables are covered by the data version check, so sessions,
+    users and other apps' tables are always read from the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _analytics_reads.get() is not None and model._meta.app_label == 'mains':
+            return analytics_db_alias()
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data, so relations across them are fine
+        return True
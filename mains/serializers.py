@@ -1,5 +1,19 @@
 from rest_framework import serializers
 from .models import Platform, Customer, Order, Delivery
+from .money import from_paise, to_paise
+
+class PaiseField(serializers.DecimalField):
+    """
+    Money held as integer paise, rendered in rupees with 2 decimal places and no digit limit.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(max_digits=None, decimal_places=2, **kwargs)
+
+    def to_representation(self, value):
+        return super().to_representation(from_paise(value))  # Paise become Decimal only here
+
+    def to_internal_value(self, data):
+        return to_paise(super().to_internal_value(data))
 
 class MonthlySalesVolumeSerializer(serializers.Serializer):  # Note: serializers.Serializer
     month = serializers.DateField()  # For the date field
@@ -7,10 +21,29 @@ class MonthlySalesVolumeSerializer(serializers.Serializer):  # Note: serializers
 
 class MonthlyRevenueSerializer(serializers.Serializer):  # Note: serializers.Serializer
     month = serializers.DateField()  # For the date field
-    total_revenue = serializers.DecimalField(max_digits=10, decimal_places=2) # For the aggregated revenue
+    total_revenue = PaiseField(source='total_revenue_paise')  # For the aggregated revenue, summed in paise
+
+class ApproxMonthlySalesVolumeSerializer(MonthlySalesVolumeSerializer):
+    total_quantity_error = serializers.IntegerField()  # ~95% confidence half-width
+
+class ApproxMonthlyRevenueSerializer(MonthlyRevenueSerializer):
+    total_revenue_error = PaiseField(source='total_revenue_error_paise')  # ~95% confidence half-width
 
 class CategorySerializer(serializers.Serializer):
     category = serializers.SerializerMethodField()
 
     def get_category(self, obj):
         return obj  # obj will be the string (category name) itself
+
+
+class TopCustomerSerializer(serializers.ModelSerializer):
+    lifetime_revenue = PaiseField(source='lifetime_revenue_paise')
+    platforms = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Customer
+        fields = ['customer_id', 'customer_name', 'order_count', 'lifetime_revenue',
+                  'first_sale_date', 'last_sale_date', 'platforms']
+
+    def get_platforms(self, obj):
+        return obj.platforms.split(',') if obj.platforms else []  # Stored comma-separated on the rollup
@@ -0,0 +1,136 @@
+import fcntl
+import json
+import mmap
+import os
+import struct
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+# File layout: fixed preamble, JSON header, then 64-byte aligned little-endian column arrays
+MAGIC = b'FIHUBSNP'
+FORMAT_VERSION = 2  # 2: added customer_hash and product_hash columns
+PREAMBLE = struct.Struct('<8sII')  # magic, format version, header length
+ALIGNMENT = 64
+
+
+class SnapshotFormatError(Exception):
+    """
+    Raised when a snapshot file is truncated, foreign or written by an incompatible format version.
+    """
+
+
+def snapshot_path(directory, version):
+    """
+    Returns the file name used for the snapshot of a given data version.
+    """
+    return Path(directory) / f'orders-{version}.snap'
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_snapshot(snapshot, directory, keep=2):
+    """
+    Writes a snapshot as orders-<version>.snap and removes all but the newest `keep` files.
+
+    The file is written under a temporary name and renamed into place, so
+    readers never see a partial file. Unlinking older files is safe while
+    other processes still have them mapped.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    names = list(snapshot.columns)
+    arrays = [np.ascontiguousarray(snapshot.columns[name], dtype=snapshot.columns[name].dtype.newbyteorder('<'))
+              for name in names]
+
+    # Column offsets depend on the header length and vice versa, so grow the data start until the header fits
+    header = {'data_version': snapshot.version, 'row_count': len(snapshot),
+              'dictionaries': snapshot.dictionaries, 'columns': {}}
+    data_start = 0
+    while True:
+        offset = data_start
+        for name, array in zip(names, arrays):
+            header['columns'][name] = {'dtype': array.dtype.str, 'offset': offset}
+            offset = _align(offset + array.nbytes)
+        header_bytes = json.dumps(header).encode('utf-8')
+        needed = _align(PREAMBLE.size + len(header_bytes))
+        if needed <= data_start:
+            break
+        data_start = needed
+
+    fd, tmp_name = tempfile.mkstemp(dir=directory, prefix='.orders-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+            f.write(header_bytes)
+            for name, array in zip(names, arrays):
+                f.seek(header['columns'][name]['offset'])
+                f.write(array.tobytes())
+            f.truncate(offset)  # Pad to the end of the last column so empty columns still map
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_name, 0o644)
+        path = snapshot_path(directory, snapshot.version)
+        os.replace(tmp_name, path)  # Atomic swap: readers see the old file or the complete new one
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+    snapshots = sorted(directory.glob('orders-*.snap'), key=lambda p: p.stat().st_mtime, reverse=True)
+    for old in snapshots[keep:]:
+        old.unlink(missing_ok=True)
+    return path
+
+
+def read_snapshot(path):
+    """
+    Memory-maps a snapshot file read-only.
+
+    Returns (data_version, columns, dictionaries); the column arrays are
+    read-only views onto the shared page cache rather than private copies.
+    """
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)  # The mapping outlives the file object
+
+    if len(buffer) < PREAMBLE.size:
+        raise SnapshotFormatError(f"{path} is too short to be a snapshot")
+    magic, format_version, header_length = PREAMBLE.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise SnapshotFormatError(f"{path} is not a snapshot file")
+    if format_version != FORMAT_VERSION:
+        raise SnapshotFormatError(f"{path} has format version {format_version}, expected {FORMAT_VERSION}")
+    if PREAMBLE.size + header_length > len(buffer):
+        raise SnapshotFormatError(f"{path} is truncated in its header")
+    try:
+        header = json.loads(buffer[PREAMBLE.size:PREAMBLE.size + header_length])
+    except ValueError as e:
+        raise SnapshotFormatError(f"{path} has an unreadable header: {str(e)}")
+
+    row_count = header['row_count']
+    columns = {}
+    for name, spec in header['columns'].items():
+        dtype = np.dtype(spec['dtype'])
+        if spec['offset'] + dtype.itemsize * row_count > len(buffer):
+            raise SnapshotFormatError(f"{path} is truncated in column '{name}'")
+        columns[name] = np.frombuffer(buffer, dtype=dtype, count=row_count, offset=spec['offset'])
+    return header['data_version'], columns, header['dictionaries']
+
+
+@contextmanager
+def build_lock(directory):
+    """
+    Exclusive lock so only one worker per host builds a missing snapshot; the others wait and then map it.
+    """
+    path = Path(directory) / '.build.lock'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
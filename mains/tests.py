@@ -1,3 +1,964 @@
-from django.test import TestCase
+import csv
+import datetime
+import decimal
+import gzip
+import io
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from rest_framework.exceptions import ValidationError
+
+import aws_lambda_parser
+import ingest_queue
+
+from mains import analytics, dataversion, middleware, routers, snapshot_files
+from mains.middleware import choose_encoding
+from mains.money import from_paise, to_paise
+from mains.rollups import EMPTY_ROLLUP, ROLLUP_FIELDS, refresh_customer_rollups
+from mains.serializers import PaiseField
+from mains.approx import ApproxIndex
+from mains.sketches import HyperLogLog, grouped_hyperloglogs, grouped_reservoir_sample
+from mains.models import Customer, DataVersion, Delivery, Order, Platform
+
+# (order_id, customer_id, platform, category, quantity, price in paise, date of sale, delivery status or None)
+ORDERS = [
+    ('A1', 'C1', 'AMAZON', 'Electronics', 2, 19999, '2024-01-05', 'Delivered'),
+    ('A2', 'C1', 'AMAZON', 'Books', 1, 45050, '2024-01-20', 'Cancelled'),
+    ('A3', 'C2', 'AMAZON', 'Electronics', 3, 1005, '2024-02-11', 'Delivered'),
+    ('F1', 'C2', 'FLIPKART', 'Books', 5, 250, '2024-02-29', 'Shipped'),
+    ('F2', 'C3', 'FLIPKART', 'Toys', 1, 99999, '2024-03-01', None),  # No delivery row
+    ('M1', 'C1', 'MEESHO', 'Toys', 4, 12345, '2024-03-31', 'Cancelled'),
+]
+
+
+def create_orders(orders=ORDERS):
+    """
+    Creates the customers, platforms, orders and deliveries of an ORDERS-like list.
+    """
+    for order_id, customer_id, platform, category, quantity, price_paise, date_of_sale, status in orders:
+        customer, _ = Customer.objects.get_or_create(customer_id=customer_id, defaults={'customer_name': customer_id})
+        platform, _ = Platform.objects.get_or_create(platform_name=platform)
+        order = Order.objects.create(
+            order_id=order_id, product_id=f'P-{order_id}', product_name='Product', category=category,
+            quantity_sold=quantity, selling_price_paise=price_paise,
+            date_of_sale=datetime.date.fromisoformat(date_of_sale), customer=customer, platform=platform,
+        )
+        if status:
+            Delivery.objects.create(order=order, delivery_address='Address', delivery_status=status,
+                                    delivery_date=order.date_of_sale + datetime.timedelta(days=3))
+
+
+def versions(**by_alias):
+    """
+    Stand-in for get_data_version() returning a fixed version per database alias.
+    """
+    def get_data_version(using='default'):
+        version = by_alias[using]
+        if isinstance(version, Exception):
+            raise version
+        return version, None
+    return get_data_version
+
+
+@override_settings(ANALYTICS_DB_ALIAS='replica', REPLICA_RETRY_SECONDS=30)
+class AnalyticsReplicaRouterTests(TestCase):
+    """
+    Replica selection, stickiness to the primary's data version, and fallback to the primary.
+    """
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        patcher = mock.patch.object(routers, '_replica_down_until', 0.0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        dataversion._cached.clear()
+
+    def test_current_replica_serves_analytics_reads(self):
+        with mock.patch('mains.dataversion.get_data_version', versions(default=3, replica=3)):
+            self.assertEqual(routers.analytics_db_alias(), 'replica')
+
+    def test_lagging_replica_is_skipped(self):
+        with mock.patch('mains.dataversion.get_data_version', versions(default=4, replica=3)):
+            self.assertEqual(routers.analytics_db_alias(), 'default')
+
+    def test_unreachable_replica_is_skipped_until_retry(self):
+        get_version = mock.Mock(side_effect=versions(default=3, replica=DatabaseError("down")))
+        with mock.patch('mains.dataversion.get_data_version', get_version):
+            self.assertEqual(routers.analytics_db_alias(), 'default')
+            self.assertEqual(routers.analytics_db_alias(), 'default')
+        get_version.assert_called_once_with(using='replica')  # The second call did not try the replica
+
+    @override_settings(ANALYTICS_DB_ALIAS='default')
+    def test_primary_only_configuration(self):
+        self.assertEqual(routers.analytics_db_alias(), 'default')
+
+    def test_router_sends_only_analytics_reads_to_replica(self):
+        router = routers.AnalyticsReplicaRouter()
+        with mock.patch('mains.dataversion.get_data_version', versions(default=3, replica=3)):
+            self.assertEqual(router.db_for_read(Order), 'default')
+            with routers.analytics_reads():
+                self.assertEqual(router.db_for_read(Order), 'replica')
+                self.assertEqual(router.db_for_write(Order), 'default')
+                self.assertEqual(router.db_for_read(Session), 'default')  # Not covered by the data version
+                self.assertEqual(router.db_for_read(User), 'default')
+
+    def test_failed_replica_query_is_retried_on_primary(self):
+        def view():
+            alias = routers.analytics_db_alias()
+            if alias == 'replica':
+                raise DatabaseError("replica refused the query")
+            return alias
+
+        with mock.patch('mains.dataversion.get_data_version', versions(default=3, replica=3)):
+            self.assertEqual(routers.use_analytics_db(view)(), 'default')
+            self.assertEqual(routers.analytics_db_alias(), 'default')  # Skipped for REPLICA_RETRY_SECONDS
+
+    def test_failed_primary_query_is_raised(self):
+        def view():
+            routers.analytics_db_alias()
+            raise DatabaseError("primary failed")
+
+        with mock.patch('mains.dataversion.get_data_version', versions(default=4, replica=3)):
+            with self.assertRaises(DatabaseError):
+                routers.use_analytics_db(view)()
+
+    def test_data_version_is_cached_per_alias(self):
+        dataversion._cached['replica'] = ((7, None), time.monotonic())
+        dataversion.bump_data_version()
+        self.assertEqual(dataversion.get_data_version()[0], 1)  # The bump invalidated the primary's entry only
+        self.assertEqual(dataversion.get_data_version(using='replica')[0], 7)
+
+
+@override_settings(ANALYTICS_DB_ALIAS='default', ANALYTICS_SNAPSHOT_DIR=None)
+class MemoryBackendTests(TestCase):
+    """
+    The in-memory snapshot answers the monthly and summary views exactly like the SQL queries.
+    """
+    FILTERS = [
+        {},
+        {'start_date': '2024-01-15', 'end_date': '2024-03-01'},
+        {'category': 'Books'},
+        {'delivery_status': 'Cancelled'},
+        {'platform': 'FLIPKART'},
+        {'category': 'Garden'},  # Matches nothing
+    ]
+
+    def setUp(self):
+        create_orders()
+        DataVersion.objects.create(pk=1, version=1)
+        dataversion._cached.clear()
+        for name in ('_snapshot', '_refreshing'):
+            patcher = mock.patch.object(analytics, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get_json(self, path, filters):
+        response = self.client.get(path, filters)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_views_match_sql(self):
+        for path in ('/api/monthly_sales/', '/api/monthly_revenue/', '/api/summary_metrics/'):
+            for filters in self.FILTERS:
+                with self.subTest(path=path, filters=filters):
+                    with self.settings(ANALYTICS_BACKEND='database'):
+                        expected = self.get_json(path, filters)
+                    with self.settings(ANALYTICS_BACKEND='memory'):
+                        self.assertEqual(self.get_json(path, filters), expected)
+
+    def test_snapshot_totals(self):
+        snapshot = analytics.OrderSnapshot.from_database(1)
+        self.assertEqual(len(snapshot), len(ORDERS))
+        self.assertEqual(snapshot.monthly_totals(platform='AMAZON'), [
+            {'month': datetime.date(2024, 1, 1), 'total_quantity': 3, 'total_revenue_paise': 2 * 19999 + 45050},
+            {'month': datetime.date(2024, 2, 1), 'total_quantity': 3, 'total_revenue_paise': 3 * 1005},
+        ])
+        self.assertEqual(snapshot.code('category', 'Garden'), -2)
+
+    def test_previous_snapshot_is_served_while_the_new_one_loads(self):
+        first = analytics.get_snapshot()
+        self.assertEqual(first.version, 1)
+
+        DataVersion.objects.filter(pk=1).update(version=2)
+        dataversion._cached.clear()
+        with mock.patch.object(analytics.threading, 'Thread') as thread:
+            self.assertIs(analytics.get_snapshot(), first)
+            self.assertIs(analytics.get_snapshot(), first)
+        thread.assert_called_once()  # One background load, however many requests arrive meanwhile
+        self.assertEqual(thread.call_args.kwargs['args'], (2,))
+
+        analytics.refresh_snapshot(2)  # What the background thread runs
+        self.assertEqual(analytics.get_snapshot().version, 2)
+
+
+def older_format(data):
+    """
+    Rewrites a snapshot file's preamble with the previous format version.
+    """
+    return struct.pack('<8sI', snapshot_files.MAGIC, snapshot_files.FORMAT_VERSION - 1) + data[12:]
+
+
+@override_settings(ANALYTICS_SNAPSHOT_KEEP=2)
+class SnapshotFileTests(TestCase):
+    """
+    Memory-mapped snapshot files: round trip, pruning, and rebuilding files that cannot be mapped.
+    """
+
+    def setUp(self):
+        create_orders()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def assertSnapshotsEqual(self, first, second):
+        self.assertEqual(first.version, second.version)
+        self.assertEqual(first.dictionaries, second.dictionaries)
+        self.assertEqual(set(first.columns), set(second.columns))
+        for name, column in first.columns.items():
+            self.assertEqual(column.dtype, second.columns[name].dtype, name)
+            self.assertEqual(column.tolist(), second.columns[name].tolist(), name)
+
+    def test_round_trip(self):
+        snapshot = analytics.OrderSnapshot.from_database(5)
+        path = snapshot_files.write_snapshot(snapshot, self.directory)
+        self.assertEqual(path, snapshot_files.snapshot_path(self.directory, 5))
+        mapped = analytics.OrderSnapshot.from_file(path)
+        self.assertSnapshotsEqual(mapped, snapshot)
+        self.assertFalse(mapped.columns['selling_price'].flags.writeable)  # A view onto the mapping, not a copy
+
+    def test_round_trip_without_orders(self):
+        Order.objects.all().delete()
+        snapshot = analytics.OrderSnapshot.from_database(1)
+        mapped = analytics.OrderSnapshot.from_file(snapshot_files.write_snapshot(snapshot, self.directory))
+        self.assertEqual(len(mapped), 0)
+        self.assertEqual(mapped.summary()['total_orders'], 0)
+
+    def test_old_versions_are_pruned(self):
+        for version in (1, 2, 3):
+            snapshot_files.write_snapshot(analytics.OrderSnapshot.from_database(version), self.directory, keep=2)
+        remaining = sorted(path.name for path in snapshot_files.snapshot_path(self.directory, 0).parent.glob('*.snap'))
+        self.assertEqual(remaining, ['orders-2.snap', 'orders-3.snap'])
+
+    def write_corrupt(self, version, mutate):
+        path = snapshot_files.write_snapshot(analytics.OrderSnapshot.from_database(version), self.directory)
+        data = bytearray(path.read_bytes())
+        path.write_bytes(mutate(data))
+        return path
+
+    def test_unreadable_files_raise_format_error(self):
+        cases = {
+            'format version': older_format,
+            'magic': lambda data: b'NOTASNAP' + data[8:],
+            'truncated': lambda data: data[:len(data) // 2],
+            'truncated header': lambda data: data[:40],
+            'too short': lambda data: data[:4],
+        }
+        for name, mutate in cases.items():
+            with self.subTest(name):
+                path = self.write_corrupt(7, mutate)
+                with self.assertRaises(snapshot_files.SnapshotFormatError):
+                    snapshot_files.read_snapshot(path)
+
+    def test_file_from_older_format_is_rebuilt(self):
+        path = self.write_corrupt(4, older_format)
+        with self.settings(ANALYTICS_SNAPSHOT_DIR=self.directory):
+            snapshot = analytics.load_snapshot(4)
+        self.assertSnapshotsEqual(snapshot, analytics.OrderSnapshot.from_database(4))
+        self.assertEqual(snapshot_files.read_snapshot(path)[0], 4)  # The rewritten file maps again
+
+    def test_file_pruned_after_exists_check_is_rebuilt(self):
+        snapshot_files.write_snapshot(analytics.OrderSnapshot.from_database(4), self.directory)
+        from_file = analytics.OrderSnapshot.from_file
+        failures = [FileNotFoundError(), FileNotFoundError()]  # Pruned before both the first and the locked attempt
+
+        def pruned_then_mapped(path):
+            if failures:
+                raise failures.pop()
+            return from_file(path)
+
+        with self.settings(ANALYTICS_SNAPSHOT_DIR=self.directory), \
+                mock.patch.object(analytics.OrderSnapshot, 'from_file', side_effect=pruned_then_mapped) as mapped:
+            self.assertEqual(analytics.load_snapshot(4).version, 4)
+        self.assertEqual(mapped.call_count, 3)
+
+
+def synthetic_snapshot(rows=30000, seed=0):
+    """
+    Builds an OrderSnapshot over three months of random orders without touching the database.
+    """
+    rng = np.random.default_rng(seed)
+    dates = rng.integers(analytics.to_days('2024-01-01'), analytics.to_days('2024-04-01'), rows).astype(np.int32)
+    columns = {
+        'date_of_sale': dates,
+        'month': dates.astype('datetime64[D]').astype('datetime64[M]').astype(np.int32),
+        'quantity_sold': rng.integers(1, 6, rows).astype(np.int32),
+        'selling_price': rng.integers(100, 500000, rows).astype(np.int64),
+        'customer_hash': np.array([analytics.stable_hash(f'C{i}') for i in rng.integers(0, 5000, rows)], dtype=np.uint64),
+        'product_hash': np.array([analytics.stable_hash(f'P{i}') for i in rng.integers(0, 800, rows)], dtype=np.uint64),
+        'category': rng.integers(0, 3, rows).astype(np.int32),
+        'delivery_status': rng.integers(0, 2, rows).astype(np.int32),
+        'platform': rng.integers(0, 2, rows).astype(np.int32),
+    }
+    dictionaries = {'category': ['Books', 'Electronics', 'Toys'], 'delivery_status': ['Delivered', 'Cancelled'],
+                    'platform': ['AMAZON', 'FLIPKART']}
+    return analytics.OrderSnapshot(seed, columns, dictionaries)
+
+
+class ApproximateAnalyticsTests(TestCase):
+    """
+    HyperLogLog sketches and stratified sample estimates checked against exact answers.
+    """
+
+    def test_hyperloglog_count(self):
+        for distinct in (100, 50000):
+            with self.subTest(distinct=distinct):
+                sketch = HyperLogLog(12).add_hashes([analytics.stable_hash(str(i)) for i in range(distinct)])
+                self.assertAlmostEqual(sketch.count(), distinct, delta=3 * sketch.relative_error * distinct)
+
+    def test_hyperloglog_merge_equals_union(self):
+        hashes = np.array([analytics.stable_hash(str(i)) for i in range(3000)], dtype=np.uint64)
+        merged = HyperLogLog(12).add_hashes(hashes[:2000]).merge(HyperLogLog(12).add_hashes(hashes[1000:]))
+        self.assertEqual(merged.registers.tolist(), HyperLogLog(12).add_hashes(hashes).registers.tolist())
+
+    def test_grouped_hyperloglogs_match_per_group_sketches(self):
+        snapshot = synthetic_snapshot(rows=2000)
+        groups = snapshot.columns['category']
+        registers = grouped_hyperloglogs(groups, 3, snapshot.columns['customer_hash'], 12)
+        for group in range(3):
+            expected = HyperLogLog(12).add_hashes(snapshot.columns['customer_hash'][groups == group])
+            self.assertEqual(registers[group].tolist(), expected.registers.tolist())
+
+    def test_grouped_reservoir_sample(self):
+        groups = np.repeat([0, 1, 2], [5, 100, 40])
+        rows = grouped_reservoir_sample(groups, 30, seed=1)
+        self.assertEqual(np.bincount(groups[rows]).tolist(), [5, 30, 30])  # Small groups are kept whole
+        self.assertEqual(len(set(rows.tolist())), len(rows))
+        self.assertEqual(rows.tolist(), grouped_reservoir_sample(groups, 30, seed=1).tolist())
+
+    def test_full_sample_is_exact(self):
+        snapshot = synthetic_snapshot(rows=3000)
+        index = ApproxIndex(snapshot, sample_size=3000, precision=12)
+        for filters in ({}, {'category': 'Books', 'start_date': '2024-02-10'}):
+            with self.subTest(filters=filters):
+                exact = snapshot.monthly_totals(**filters)
+                estimate = index.monthly_totals(**filters)
+                self.assertEqual([{key: row[key] for key in exact[0]} for row in estimate], exact)
+                self.assertTrue(all(row['total_revenue_error_paise'] == 0 for row in estimate))
+
+    def test_estimates_are_within_error_bounds(self):
+        snapshot = synthetic_snapshot()
+        index = ApproxIndex(snapshot, sample_size=1000, precision=12)
+        for filters in ({}, {'platform': 'FLIPKART'}, {'start_date': '2024-01-15', 'end_date': '2024-03-10'}):
+            with self.subTest(filters=filters):
+                exact = snapshot.summary(**filters)
+                estimate = index.summary(**filters)
+                for name in ('total_orders', 'total_products_sold', 'total_revenue', 'canceled_order_percentage'):
+                    self.assertLessEqual(abs(estimate[name] - exact[name]), estimate[f'{name}_error'], name)
+
+                mask = snapshot.mask(**filters)
+                for name, column in (('distinct_customers', 'customer_hash'), ('distinct_products', 'product_hash')):
+                    distinct = len(np.unique(snapshot.columns[column][mask]))
+                    self.assertLessEqual(abs(estimate[name] - distinct), estimate[f'{name}_error'], name)
+
+                for exact_month, month in zip(snapshot.monthly_totals(**filters), index.monthly_totals(**filters)):
+                    self.assertEqual(month['month'], exact_month['month'])
+                    self.assertLessEqual(abs(month['total_revenue_paise'] - exact_month['total_revenue_paise']),
+                                         month['total_revenue_error_paise'])
+
+
+@override_settings(ANALYTICS_DB_ALIAS='default', ANALYTICS_BACKEND='database')
+class CompressionAndConditionalTests(TestCase):
+    """
+    Accept-Encoding negotiation, ETag / Last-Modified revalidation and the streamed CSV export.
+    """
+
+    def setUp(self):
+        create_orders()
+        DataVersion.objects.create(pk=1, version=1)
+        dataversion._cached.clear()
+
+    def assertEncodings(self, cases):
+        for header, expected in cases.items():
+            with self.subTest(header=header):
+                self.assertEqual(choose_encoding(header), expected)
+
+    def test_choose_encoding_without_zstd(self):
+        with mock.patch.object(middleware, 'zstandard', None):
+            self.assertEncodings({
+                '': None,
+                'identity': None,
+                'gzip': 'gzip',
+                'gzip, deflate, br, zstd': 'gzip',  # zstd is only offered when the package is installed
+                '*': 'gzip',
+                'zstd': None,
+                'gzip;q=oops': None,
+            })
+
+    @skipUnless(middleware.zstandard, "zstandard is not installed")
+    def test_choose_encoding_with_zstd(self):
+        self.assertEncodings({
+            'gzip, deflate, br, zstd': 'zstd',  # zstd wins ties
+            'GZIP;q=0.8, zstd;q=0.5': 'gzip',
+            'zstd;q=0, gzip': 'gzip',
+            '*': 'zstd',
+            '*;q=0.1, gzip;q=0': 'zstd',
+        })
+
+    def test_csv_export_is_compressed_while_streaming(self):
+        plain = b''.join(self.client.get('/api/download_csv/').streaming_content)
+        rows = list(csv.reader(io.StringIO(plain.decode())))
+        self.assertEqual(len(rows), len(ORDERS) + 1)  # The order without a delivery is exported too
+        exported = {row[rows[0].index('order_id')]: dict(zip(rows[0], row)) for row in rows[1:]}
+        self.assertEqual(exported['F2']['delivery'], '')
+        self.assertEqual(exported['A3']['selling_price'], '10.05')  # Rupees, not paise
+
+        decompress = {'gzip': gzip.decompress}
+        if middleware.zstandard is not None:
+            decompress['zstd'] = lambda data: middleware.zstandard.ZstdDecompressor().decompressobj().decompress(data)
+        for encoding, decode in decompress.items():
+            with self.subTest(encoding=encoding):
+                response = self.client.get('/api/download_csv/', HTTP_ACCEPT_ENCODING=encoding)
+                self.assertEqual(response['Content-Encoding'], encoding)
+                self.assertIn('Accept-Encoding', response['Vary'])
+                self.assertFalse(response.has_header('Content-Length'))
+                self.assertTrue(response['ETag'].startswith('W/"'))  # The compressed bytes differ from the plain ones
+                self.assertEqual(decode(b''.join(response.streaming_content)), plain)
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.client.get('/api/categories/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_unchanged_data_is_answered_with_304(self):
+        response = self.client.get('/api/summary_metrics/')
+        self.assertEqual(response['ETag'], '"data-1"')
+        self.assertIn('no-cache', response['Cache-Control'])
+        last_modified = response['Last-Modified']
+
+        for headers in ({'HTTP_IF_NONE_MATCH': '"data-1"'}, {'HTTP_IF_NONE_MATCH': 'W/"data-1"'},
+                        {'HTTP_IF_MODIFIED_SINCE': last_modified}):
+            with self.subTest(headers=headers):
+                self.assertEqual(self.client.get('/api/summary_metrics/', **headers).status_code, 304)
+
+        dataversion.bump_data_version()
+        response = self.client.get('/api/summary_metrics/', HTTP_IF_NONE_MATCH='"data-1"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], '"data-2"')
+
+    @override_settings(ANALYTICS_BACKEND='memory', ANALYTICS_SNAPSHOT_DIR=None)
+    def test_stale_snapshot_is_served_under_its_own_etag(self):
+        previous = analytics.OrderSnapshot.from_database(1)
+        dataversion.bump_data_version()
+        with mock.patch.object(analytics, '_snapshot', previous), \
+                mock.patch.object(analytics, '_refreshing', 2):  # The new snapshot is still loading
+            response = self.client.get('/api/monthly_revenue/')
+        self.assertEqual(response['ETag'], '"data-1"')
+        self.assertFalse(response.has_header('Last-Modified'))
+
+
+@override_settings(ANALYTICS_DB_ALIAS='default')
+class CustomerRollupTests(TestCase):
+    """
+    Per-customer rollups, the cursor-paginated leaderboard and the repeat-purchase metrics.
+    """
+
+    def setUp(self):
+        create_orders()
+        Customer.objects.create(customer_id='C9', customer_name='No orders yet')
+        dataversion._cached.clear()
+
+    def test_rollups(self):
+        call_command('rebuild_customer_rollups', stdout=io.StringIO())
+        c1 = Customer.objects.get(pk='C1')
+        self.assertEqual(c1.order_count, 3)
+        self.assertEqual(c1.lifetime_revenue_paise, 2 * 19999 + 45050 + 4 * 12345)
+        self.assertEqual((c1.first_sale_date, c1.last_sale_date), (datetime.date(2024, 1, 5), datetime.date(2024, 3, 31)))
+        self.assertEqual(c1.platforms, 'AMAZON,MEESHO')
+        self.assertEqual(Customer.objects.get(pk='C9').order_count, 0)
+        self.assertEqual(DataVersion.objects.get(pk=1).version, 1)
+
+    def test_moved_orders_refresh_both_customers(self):
+        refresh_customer_rollups()
+        Order.objects.filter(customer_id='C3').update(customer_id='C2')  # C3 is left without orders
+        self.assertEqual(refresh_customer_rollups(['C2', 'C3']), 2)
+
+        c2, c3 = Customer.objects.get(pk='C2'), Customer.objects.get(pk='C3')
+        self.assertEqual((c2.order_count, c2.lifetime_revenue_paise), (3, 3 * 1005 + 5 * 250 + 99999))
+        self.assertEqual(c2.platforms, 'AMAZON,FLIPKART')
+        self.assertEqual((c3.order_count, c3.lifetime_revenue_paise, c3.last_sale_date, c3.platforms), (0, 0, None, ''))
+
+    def test_full_rebuild_resets_customers_without_orders(self):
+        refresh_customer_rollups()
+        Order.objects.filter(customer_id='C3').delete()
+        self.assertEqual(refresh_customer_rollups(), 3)  # C1 and C2 from their orders, then C3's reset
+        c3 = Customer.objects.get(pk='C3')
+        self.assertEqual((c3.order_count, c3.lifetime_revenue_paise, c3.last_sale_date, c3.platforms), (0, 0, None, ''))
+
+    @skipUnless(connection.vendor == 'postgresql', "finish_ingest's UPDATE ... FROM is PostgreSQL SQL")
+    def test_finish_ingest_matches_refresh(self):
+        def rollups():
+            return list(Customer.objects.order_by('customer_id').values_list('customer_id', *ROLLUP_FIELDS))
+
+        refresh_customer_rollups()
+        Order.objects.filter(customer_id='C3').update(customer_id='C2')  # C3 is left without orders
+        refresh_customer_rollups()
+        expected = rollups()
+
+        Customer.objects.update(**EMPTY_ROLLUP)
+        Customer.objects.filter(pk='C3').update(order_count=1, platforms='FLIPKART')  # Stale, as before the move
+        with connection.cursor() as cur:
+            aws_lambda_parser.finish_ingest(cur, ['C1', 'C2', 'C3', 'C9'])
+        self.assertEqual(rollups(), expected)
+
+    def test_top_customers_cursor_pagination(self):
+        refresh_customer_rollups()
+        response = self.client.get('/api/top_customers/', {'page_size': 2}).json()
+        self.assertNotIn('count', response)  # Cursor pagination never counts the table
+        self.assertIsNone(response['previous'])
+        self.assertEqual(response['results'][0], {
+            'customer_id': 'C1', 'customer_name': 'C1', 'order_count': 3, 'lifetime_revenue': '1344.28',
+            'first_sale_date': '2024-01-05', 'last_sale_date': '2024-03-31', 'platforms': ['AMAZON', 'MEESHO'],
+        })
+
+        customer_ids = [row['customer_id'] for row in response['results']]
+        while response['next']:
+            response = self.client.get(response['next']).json()
+            customer_ids += [row['customer_id'] for row in response['results']]
+        self.assertEqual(customer_ids, ['C1', 'C3', 'C2'])  # By revenue; C9 has no orders
+
+    def test_customer_metrics(self):
+        refresh_customer_rollups()
+        metrics = self.client.get('/api/customer_metrics/').json()
+        self.assertEqual(metrics['total_customers'], 3)
+        self.assertEqual(metrics['repeat_customers'], 2)
+        self.assertAlmostEqual(metrics['repeat_purchase_rate'], 200 / 3)
+        self.assertAlmostEqual(metrics['average_orders_per_customer'], 2)
+        self.assertEqual(metrics['average_lifetime_revenue'], 795.64)  # (134428 + 4265 + 99999) / 3 paise
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def execute(self, sql, params=None):
+        self.connection.statements.append(sql)
+
+    def fetchone(self):
+        return (self.connection.slot_free,)  # pg_try_advisory_lock
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """
+    Records the statements and commits of a psycopg2 connection that ingest_queue drives.
+    """
+
+    def __init__(self, slot_free=True):
+        self.slot_free = slot_free
+        self.statements = []
+        self.commits = 0
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def ingested(cur, records, mode):
+    return {'message': f"Loaded {len(records)} rows", 'changed': True, 'affected_customers': ['C1']}
+
+
+class IngestQueueTests(SimpleTestCase):
+    """
+    Job claiming, leases, backpressure, and how IngestWorker completes, retries and fails jobs.
+    """
+
+    def setUp(self):
+        self.queue = ingest_queue.SQLiteJobQueue(':memory:', max_pending=3)
+        self.connections = []
+        for target, replacement in (('load_csv', lambda csv_url: [{'row': 1}]), ('ingest', ingested),
+                                    ('finish_ingest', lambda cur, customers: None)):
+            patcher = mock.patch.object(aws_lambda_parser, target, side_effect=replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def worker(self, slot_free=True, **kwargs):
+        def connect():
+            self.connections.append(FakeConnection(slot_free))
+            return self.connections[-1]
+        kwargs.setdefault('max_writers', 2)
+        return ingest_queue.IngestWorker(self.queue, connect=connect, **kwargs)
+
+    def make_runnable(self):
+        self.queue._execute("UPDATE ingest_job SET next_run_at = 0")
+
+    def test_job_queue_is_abstract(self):
+        with self.assertRaises(TypeError):
+            ingest_queue.JobQueue()
+
+    def test_claim_and_lease(self):
+        job_id = self.queue.enqueue('https://drive.google.com/file/d/abc/view', mode='delta')
+        [job] = self.queue.claim(10, lease_seconds=60)
+        self.assertEqual((job['id'], job['mode'], job['attempts']), (job_id, 'delta', 1))
+        self.assertEqual(self.queue.get(job_id)['status'], 'running')
+        self.assertEqual(self.queue.claim(10, lease_seconds=60), [])  # Hidden while the lease lasts
+
+        self.queue._execute("UPDATE ingest_job SET lease_expires_at = 0")  # Its worker died
+        self.assertEqual(self.queue.claim(10, lease_seconds=60)[0]['attempts'], 2)
+
+    def test_enqueue_backpressure(self):
+        for _ in range(3):
+            self.queue.enqueue('url')
+        with self.assertRaises(ingest_queue.QueueFull):
+            self.queue.enqueue('url')
+        with self.assertRaises(ValueError):
+            ingest_queue.SQLiteJobQueue(':memory:').enqueue('url', mode='upsert')
+
+    def test_jobs_are_batched_into_one_transaction(self):
+        job_ids = [self.queue.enqueue('url') for _ in range(3)]
+        self.assertEqual(self.worker(max_writers=1).run_once(), 3)
+        self.assertEqual([self.queue.get(job_id)['status'] for job_id in job_ids], ['done'] * 3)
+        self.assertEqual(self.queue.get(job_ids[0])['result'], {'message': "Loaded 1 rows", 'changed': True})
+        [connection] = self.connections  # One connection for the slot and every write
+        self.assertEqual(connection.commits, 2)  # The slot's transaction, then the batch
+        self.assertEqual(connection.statements.count('SAVEPOINT ingest_job'), 3)
+        self.assertTrue(connection.closed)
+
+    def test_busy_writer_slots_leave_jobs_unclaimed(self):
+        job_id = self.queue.enqueue('url')
+        self.assertIsNone(self.worker(slot_free=False).run_until_idle())
+        job = self.queue.get(job_id)
+        self.assertEqual((job['status'], job['attempts']), ('queued', 0))
+        self.assertTrue(ingest_queue.is_runnable(job))  # Any worker that gets a slot can take it at once
+        aws_lambda_parser.load_csv.assert_not_called()
+        [connection] = self.connections
+        self.assertTrue(connection.closed)
+
+    def test_transient_errors_are_retried_then_failed(self):
+        aws_lambda_parser.load_csv.side_effect = OSError("connection reset")
+        job_id = self.queue.enqueue('url')
+        worker = self.worker(max_attempts=2)
+
+        worker.run_once()
+        job = self.queue.get(job_id)
+        self.assertEqual((job['status'], job['attempts']), ('queued', 1))
+        self.assertIn('connection reset', job['last_error'])
+        self.assertGreater(job['next_run_at'], time.time())
+        self.assertEqual(worker.run_once(), 0)  # Waiting for its backoff
+
+        self.make_runnable()
+        worker.run_once()
+        self.assertEqual(self.queue.get(job_id)['status'], 'failed')
+
+    def test_permanent_errors_fail_at_once(self):
+        aws_lambda_parser.load_csv.side_effect = ValueError("Unsupported platform: EBAY")
+        job_id = self.queue.enqueue('url')
+        self.worker().run_once()
+        job = self.queue.get(job_id)
+        self.assertEqual((job['status'], job['attempts']), ('failed', 1))
+
+    def test_failed_job_does_not_fail_its_batch(self):
+        aws_lambda_parser.ingest.side_effect = [ingested(None, [1], 'insert'), KeyError('order_id')]
+        good, bad = self.queue.enqueue('url'), self.queue.enqueue('url')
+        self.worker(max_writers=1).run_once()
+        self.assertEqual(self.queue.get(good)['status'], 'done')
+        self.assertEqual(self.queue.get(bad)['status'], 'failed')
+        self.assertIn('ROLLBACK TO SAVEPOINT ingest_job', self.connections[0].statements)
+
+    def test_failed_commit_keeps_permanent_failures(self):
+        aws_lambda_parser.ingest.side_effect = [ingested(None, [1], 'insert'), KeyError('order_id')]
+        aws_lambda_parser.finish_ingest.side_effect = OSError("server closed the connection")
+        good, bad = self.queue.enqueue('url'), self.queue.enqueue('url')
+        self.worker(max_writers=1).run_once()
+        self.assertEqual(self.queue.get(good)['status'], 'queued')  # Retried: the commit failure was transient
+        self.assertEqual(self.queue.get(bad)['status'], 'failed')
+        self.assertIn("'order_id'", self.queue.get(bad)['last_error'])
+
+    def test_permanent_error_classification(self):
+        class PostgresError(Exception):
+            def __init__(self, pgcode):
+                self.pgcode = pgcode
+
+        http_error = lambda code: ingest_queue.HTTPError('url', code, 'error', None, None)
+        for error in (ValueError(), KeyError(), decimal.InvalidOperation(), http_error(404), PostgresError('22P02'),
+                      PostgresError('23505')):
+            self.assertTrue(ingest_queue.is_permanent_error(error), error)
+        for error in (OSError(), http_error(429), http_error(503), PostgresError('40P01'), DatabaseError()):
+            self.assertFalse(ingest_queue.is_permanent_error(error), error)
+
+    def test_lambda_requires_the_shared_queue(self):
+        with mock.patch.dict('os.environ', {'AWS_LAMBDA_FUNCTION_NAME': 'ingest', 'INGEST_QUEUE': 'sqlite:////tmp/q'}):
+            with self.assertRaises(ValueError):
+                ingest_queue.default_queue()
+
+    def test_lambda_handler_waits_for_its_job(self):
+        context = mock.Mock(get_remaining_time_in_millis=mock.Mock(return_value=60000))
+        runs = []
+
+        def run_until_idle(worker):
+            runs.append(worker)
+            if len(runs) == 2:  # Our job was waiting on a writer slot the first time round
+                self.worker().run_once()
+
+        with mock.patch.object(ingest_queue, 'default_queue', return_value=self.queue), \
+                mock.patch.object(ingest_queue.IngestWorker, 'run_until_idle', run_until_idle), \
+                mock.patch.object(aws_lambda_parser.time, 'sleep'):
+            result = aws_lambda_parser.lambda_handler({'csv_url': 'url'}, context)
+        self.assertEqual(result['statusCode'], 200)
+        self.assertEqual(result['body'], "Loaded 1 rows")
+
+    def test_lambda_handler_only_polls_a_job_running_elsewhere(self):
+        def claimed_by_another_worker(worker):
+            self.queue.claim(10, lease_seconds=60)
+            return 0
+
+        with mock.patch.object(ingest_queue, 'default_queue', return_value=self.queue), \
+                mock.patch.object(aws_lambda_parser, '_wait_budget', return_value=0.05), \
+                mock.patch.object(ingest_queue.IngestWorker, 'run_until_idle', autospec=True,
+                                  side_effect=claimed_by_another_worker) as run_until_idle:
+            result = aws_lambda_parser.lambda_handler({'csv_url': 'url'}, None)
+        self.assertEqual((result['statusCode'], result['job']['status']), (202, 'running'))
+        run_until_idle.assert_called_once()
+
+    def test_lambda_handler_answers_202_before_timing_out(self):
+        context = mock.Mock(get_remaining_time_in_millis=mock.Mock(return_value=1000))  # Already inside the margin
+        with mock.patch.object(ingest_queue, 'default_queue', return_value=self.queue), \
+                mock.patch.object(ingest_queue.IngestWorker, 'run_until_idle'):
+            result = aws_lambda_parser.lambda_handler({'csv_url': 'url'}, context)
+            self.assertEqual(result['statusCode'], 202)
+            polled = aws_lambda_parser.lambda_handler({'job_id': result['job']['id']}, None)
+            self.assertEqual((polled['statusCode'], polled['body']), (200, 'queued'))
+            self.assertEqual(aws_lambda_parser.lambda_handler({'job_id': 999}, None)['statusCode'], 404)
+
+
+FLIPKART_CSV = """OrderID,ProductID,ProductName,Category,QuantitySold,SellingPrice,DateOfSale,CustomerID,CustomerName,ContactEmail,PhoneNumber,DeliveryAddress,DeliveryDate,DeliveryStatus,Platform,CouponUsed,ReturnWindow
+F1,P001,Phone,Electronics,2,19.99,{0},007,Asha,asha@example.com,09876543210,Pune,{1},Delivered,Flipkart,True,7
+F2,P002,Novel,Books,1,1.005,{1},12,Ravi,,,Delhi,,Cancelled,Flipkart,no,
+F3,P003,Kite,Toys,3,0.285,{2},13,Meera,meera@example.com,9123456789,Goa,{0},Shipped,Flipkart,,30
+F4,P004,Lamp,Home,1,2.675,not a date,14,Dev,dev@example.com,9000000000,Agra,{2},Delivered,Flipkart,1,14
+"""
+
+
+class CsvEngineParityTests(SimpleTestCase):
+    """
+    The standard library and pandas CSV engines produce the same records, value for value and type for type.
+    """
+
+    def parse(self, content):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write(content)
+        self.addCleanup(os.unlink, f.name)
+        return {engine: read(f.name) for engine, read in aws_lambda_parser.CSV_ENGINES.items()}
+
+    def assertEnginesAgree(self, content):
+        records = self.parse(content)
+        typed = {engine: [{key: (type(value), value) for key, value in row.items()} for row in rows]
+                 for engine, rows in records.items()}
+        self.assertEqual(typed['csv'], typed['pandas'])
+        return records['csv']
+
+    def test_flipkart_records(self):
+        rows = self.assertEnginesAgree(FLIPKART_CSV.format('2024-01-05', '2024-01-20', '2024-02-29'))
+        first, second, third, fourth = rows
+        self.assertEqual((first['customer_id'], first['phone_number']), ('007', '09876543210'))  # Digits kept as text
+        self.assertEqual((first['return_window'], second['return_window']), (7, None))
+        self.assertEqual([row['coupon_used'] for row in rows], [True, False, None, True])
+        self.assertEqual([row['selling_price_paise'] for row in rows], [1999, 101, 29, 268])  # Half up, no float error
+        self.assertEqual(first['date_of_sale'], datetime.date(2024, 1, 5))
+        self.assertIsNone(second['delivery_date'])
+        self.assertIsNone(fourth['date_of_sale'])
+
+    def test_date_formats(self):
+        cases = [
+            ('01/05/2024', '01/20/2024', '02/29/2024'),  # Month first, like pandas' default
+            ('13/01/2024', '20/01/2024', '29/02/2024'),  # Only day first fits the first value
+            ('2024/01/05', '2024/01/20', '2024/02/29'),
+            ('"Jan 05, 2024"', '"Jan 20, 2024"', '"Feb 29, 2024"'),  # Quoted, as the comma requires
+            ('2024-01-05 10:30:00', '2024-01-20 08:00:00', '2024-02-29 23:59:59'),
+        ]
+        for dates in cases:
+            with self.subTest(dates=dates):
+                self.assertEnginesAgree(FLIPKART_CSV.format(*dates))
+
+    def test_ambiguous_dates_follow_the_first_value(self):
+        rows = self.assertEnginesAgree(FLIPKART_CSV.format('01/05/2024', '05/01/2024', '12/31/2024'))
+        self.assertEqual([row['date_of_sale'] for row in rows[:3]],
+                         [datetime.date(2024, 1, 5), datetime.date(2024, 5, 1), datetime.date(2024, 12, 31)])
+
+    def test_unsupported_platform(self):
+        content = FLIPKART_CSV.format('2024-01-05', '2024-01-20', '2024-02-29').replace('Flipkart', 'Ebay')
+        for engine, read in aws_lambda_parser.CSV_ENGINES.items():
+            with self.subTest(engine=engine):
+                with tempfile.NamedTemporaryFile('w', suffix='.csv') as f:
+                    f.write(content)
+                    f.flush()
+                    with self.assertRaises(ValueError):
+                        read(f.name)
+
+    def test_csv_engine_does_not_import_pandas(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as f:
+            f.write(FLIPKART_CSV.format('2024-01-05', '2024-01-20', '2024-02-29'))
+            f.flush()
+            code = (f"import sys, aws_lambda_parser; aws_lambda_parser.read_csv_records({f.name!r}); "
+                    "print(sorted({'numpy', 'pandas'} & set(sys.modules)))")
+            output = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True,
+                                    cwd=os.path.dirname(aws_lambda_parser.__file__)).stdout
+        self.assertEqual(output.strip(), '[]')  # Cold starts of the csv engine skip both
+
+
+def csv_record(order_id, customer_id='7', **changes):
+    """
+    One cleaned record as load_csv returns it, with the given columns changed.
+    """
+    return {
+        'order_id': order_id, 'product_id': f'P-{order_id}', 'product_name': 'Phone', 'category': 'Electronics',
+        'quantity_sold': 2, 'selling_price_paise': 1999, 'date_of_sale': datetime.date(2024, 1, 5),
+        'customer_id': customer_id, 'customer_name': 'Asha', 'contact_email': 'asha@example.com',
+        'phone_number': '9876543210', 'delivery_address': 'Pune', 'delivery_date': datetime.date(2024, 1, 9),
+        'delivery_status': 'Delivered', 'platform': 'FLIPKART', 'coupon_used': False, 'return_window': 7,
+        **changes,
+    }
+
+
+@skipUnless(connection.vendor == 'postgresql', "delta_ingest uses COPY and ON CONFLICT on PostgreSQL")
+class DeltaIngestTests(TestCase):
+    """
+    Staging, deduplication and the IS DISTINCT FROM upserts of delta_ingest, and the counts it reports.
+    """
+
+    def ingest(self, records, mode='delta'):
+        with connection.cursor() as cur:
+            return aws_lambda_parser.ingest(cur, records, mode)
+
+    def assertCounts(self, counts, inserted=0, updated=0, unchanged=0, failed=0):
+        self.assertEqual((counts['inserted'], counts['updated'], counts['unchanged'], counts['failed']),
+                         (inserted, updated, unchanged, failed))
+
+    def test_insert_update_and_unchanged(self):
+        records = [csv_record('F1'), csv_record('F2', customer_id='8'), csv_record('F3', date_of_sale=None)]
+        counts = self.ingest(records)
+        self.assertCounts(counts, inserted=2, failed=1)
+        self.assertEqual(counts['affected_customers'], ['FLIPKART_7', 'FLIPKART_8'])
+        self.assertEqual(Order.objects.get(pk='F1').customer_id, 'FLIPKART_7')
+
+        counts = self.ingest(records)
+        self.assertCounts(counts, unchanged=2, failed=1)
+        self.assertFalse(counts['changed'])
+        self.assertEqual(counts['affected_customers'], [])
+
+        records[0]['quantity_sold'] = 5
+        records[1]['delivery_status'] = 'Returned'  # Only the delivery row differs
+        counts = self.ingest(records)
+        self.assertCounts(counts, updated=2, failed=1)
+        self.assertEqual(Order.objects.get(pk='F1').quantity_sold, 5)
+        self.assertEqual(Delivery.objects.get(pk='F2').delivery_status, 'Returned')
+
+    def test_repeated_order_id_keeps_the_last_row(self):
+        counts = self.ingest([csv_record('F1'), csv_record('F1', quantity_sold=9)])
+        self.assertCounts(counts, inserted=1)
+        self.assertEqual(Order.objects.get(pk='F1').quantity_sold, 9)
+
+    def test_moved_order_refreshes_both_customers(self):
+        self.ingest([csv_record('F1'), csv_record('F2')])
+        counts = self.ingest([csv_record('F1', customer_id='8'), csv_record('F2')])
+        self.assertCounts(counts, updated=1, unchanged=1)
+        self.assertEqual(counts['affected_customers'], ['FLIPKART_7', 'FLIPKART_8'])
+
+    def test_resend_after_insert_mode_load_is_unchanged(self):
+        records = [csv_record('F1', return_window=None), csv_record('F2', delivery_partner=None)]
+        self.assertEqual(self.ingest(records, mode='insert')['success'], 2)
+        counts = self.ingest(records)
+        self.assertCounts(counts, unchanged=2)
+        self.assertIsNone(Order.objects.get(pk='F1').return_window)
+
+
+class MoneyTests(SimpleTestCase):
+    """
+    Rupee / paise conversions and PaiseField at the API edge.
+    """
+
+    def test_to_paise_rounds_half_up(self):
+        cases = {'199.99': 19999, '1.005': 101, '0.285': 29, '2.675': 268, '-1.005': -101, '10': 1000, 7: 700}
+        for amount, paise in cases.items():
+            with self.subTest(amount=amount):
+                self.assertEqual(to_paise(amount), paise)
+
+    def test_from_paise(self):
+        self.assertEqual(str(from_paise(19999)), '199.99')
+        self.assertEqual(str(from_paise(5)), '0.05')
+        self.assertEqual(str(from_paise(79564.333)), '795.64')  # Database averages are rounded to whole paise
+
+    def test_paise_field(self):
+        field = PaiseField()
+        self.assertEqual(field.to_representation(19999), '199.99')
+        self.assertEqual(field.to_representation(10 ** 15), '10000000000000.00')  # No digit limit
+        self.assertEqual(field.to_internal_value('199.99'), 19999)
+        self.assertEqual(field.to_internal_value(0.5), 50)
+        with self.assertRaises(ValidationError):
+            field.to_internal_value('1.005')  # More than 2 decimal places
+
+
+class MoneyInPaiseMigrationTests(TransactionTestCase):
+    """
+    Migration 0006 converts rupee decimals to integer paise and back without losing a paisa.
+    """
+    before = [('mains', '0005_customer_rollups')]
+    after = [('mains', '0006_money_in_paise')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())  # Leave the schema fully migrated
+
+    def test_forwards_and_backwards(self):
+        apps = self.migrate(self.before)
+        Customer = apps.get_model('mains', 'Customer')
+        Order = apps.get_model('mains', 'Order')
+        Platform = apps.get_model('mains', 'Platform')
+        customer = Customer.objects.create(customer_id='C1', customer_name='Asha', lifetime_revenue='1344.28')
+        platform = Platform.objects.create(platform_name='AMAZON')
+        prices = {'A1': '199.99', 'A2': '0.29', 'A3': '19.99', 'A4': '12345678.91'}
+        for order_id, price in prices.items():
+            Order.objects.create(order_id=order_id, product_id='P1', product_name='Product', category='Books',
+                                 quantity_sold=1, selling_price=price, date_of_sale=datetime.date(2024, 1, 5),
+                                 customer=customer, platform=platform)
+
+        apps = self.migrate(self.after)
+        paise = dict(apps.get_model('mains', 'Order').objects.values_list('order_id', 'selling_price_paise'))
+        self.assertEqual(paise, {order_id: to_paise(price) for order_id, price in prices.items()})
+        self.assertEqual(apps.get_model('mains', 'Customer').objects.get().lifetime_revenue_paise, 134428)
+
+        apps = self.migrate(self.before)
+        rupees = dict(apps.get_model('mains', 'Order').objects.values_list('order_id', 'selling_price'))
+        self.assertEqual(rupees, {order_id: decimal.Decimal(price) for order_id, price in prices.items()})
+        self.assertEqual(apps.get_model('mains', 'Customer').objects.get().lifetime_revenue, decimal.Decimal('1344.28'))
@@ -8,6 +8,8 @@ urlpatterns = [
     re_path('api/monthly_revenue/', views.MonthlyRevenue.as_view(), name='monthly_revenue'),
     re_path('api/summary_metrics/', views.summary_metrics, name='summary_metrics'),
     re_path('api/download_csv/', views.download_filtered_csv, name='download_filtered_csv'),
+    re_path('api/top_customers/', views.TopCustomers.as_view(), name='top_customers'),
+    re_path('api/customer_metrics/', views.customer_metrics, name='customer_metrics'),
     re_path('api/categories/', views.CategoryList.as_view(), name='category_list'),
     re_path('dashboard/', views.dashboard, name='dashboard'),  # Define a URL for the dashboard
 ]
\ No newline at end of file
@@ -1,52 +1,89 @@
 import csv
 from rest_framework import generics, views, response, status
 from rest_framework.decorators import api_view
-from django.db.models import Sum, Count, Case, When, IntegerField, FloatField, F, DecimalField
+from rest_framework.pagination import CursorPagination
+from django.db.models import Sum, Count, Case, When, IntegerField, FloatField, F, BigIntegerField, Avg, Q
 from django.db.models.functions import TruncMonth
-from django.http import HttpResponse
-from mains.models import Order
-from mains.serializers import MonthlyRevenueSerializer, MonthlySalesVolumeSerializer, CategorySerializer
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.http import StreamingHttpResponse
+from mains.models import Order, Customer
+from mains.money import from_paise
+from mains.serializers import (
+    MonthlyRevenueSerializer, MonthlySalesVolumeSerializer, CategorySerializer,
+    ApproxMonthlyRevenueSerializer, ApproxMonthlySalesVolumeSerializer, TopCustomerSerializer,
+)
 from django.shortcuts import render
+from django.utils.decorators import method_decorator
+from mains.routers import analytics_db_alias, use_analytics_db
+from mains.caching import data_version_conditional, snapshot_version_conditional, wants_approx
+
+FILTER_PARAMS = ('start_date', 'end_date', 'category', 'delivery_status', 'platform')
+
+def get_filter_params(request):
+    """
+    Returns the filter parameters present in the request as a dict.
+    """
+    return {name: request.GET.get(name) for name in FILTER_PARAMS if request.GET.get(name)}
+
+def filter_orders(queryset, filters):
+    """
+    Applies date range, product category, delivery status and platform filters to an Order queryset.
+    """
+    if filters.get('start_date'):
+        queryset = queryset.filter(date_of_sale__gte=filters['start_date'])  # Filter by start date
+    if filters.get('end_date'):
+        queryset = queryset.filter(date_of_sale__lte=filters['end_date'])  # Filter by end date
+    if filters.get('category'):
+        queryset = queryset.filter(category=filters['category'])  # Filter by product category
+    if filters.get('delivery_status'):
+        queryset = queryset.filter(delivery__delivery_status=filters['delivery_status'])  # Filter by delivery status
+    if filters.get('platform'):
+        queryset = queryset.filter(platform__platform_name=filters['platform'])  # Filter by platform
+    return queryset
+
+class Echo:
+    """
+    File-like object whose write() hands the line back, so csv.writer can feed a streaming response.
+    """
+    def write(self, value):
+        return value
 
 def dashboard(request):
     return render(request, 'dashboard.html')  # 'dashboard.html' is relative to the 'templates' directory
 
+@method_decorator(data_version_conditional, name='dispatch')
+@method_decorator(use_analytics_db, name='dispatch')
 class CategoryList(generics.ListAPIView):
     queryset = Order.objects.values_list('category', flat=True).distinct()
     serializer_class = CategorySerializer
 
+@method_decorator(snapshot_version_conditional, name='dispatch')
+@method_decorator(use_analytics_db, name='dispatch')
 class MonthlySalesVolume(generics.ListAPIView):
     """
     API endpoint to retrieve monthly sales volume (quantity sold).
 
     Supports filtering by date range, product category, delivery status, and platform.
+    With approx=true, answers from per-month samples and adds error bounds.
     """
     serializer_class = MonthlySalesVolumeSerializer  # Use the serializer for monthly sales data
 
+    def get_serializer_class(self):
+        return ApproxMonthlySalesVolumeSerializer if wants_approx(self.request) else self.serializer_class
+
     def get_queryset(self):
         """
         Returns a queryset of aggregated monthly sales volume, filtered by request parameters.
         """
-        queryset = Order.objects.all()  # Start with all orders
-
-        # Get filter parameters from the request
-        start_date = self.request.GET.get('start_date')
-        end_date = self.request.GET.get('end_date')
-        category = self.request.GET.get('category')
-        delivery_status = self.request.GET.get('delivery_status')
-        platform = self.request.GET.get('platform')
-
-        # Apply filters if parameters are provided
-        if start_date:
-            queryset = queryset.filter(date_of_sale__gte=start_date)  # Filter by start date
-        if end_date:
-            queryset = queryset.filter(date_of_sale__lte=end_date)  # Filter by end date
-        if category:
-            queryset = queryset.filter(category=category)  # Filter by product category
-        if delivery_status:
-            queryset = queryset.filter(delivery__delivery_status=delivery_status)  # Filter by delivery status
-        if platform:
-            queryset = queryset.filter(platform__platform_name=platform)  # Filter by platform
+        filters = get_filter_params(self.request)  # Get filter parameters from the request
+        if wants_approx(self.request):
+            from mains.approx import get_approx_index  # numpy is only imported when an approximate answer is asked for
+            return get_approx_index().monthly_totals(**filters)  # Estimate from per-month samples
+        if settings.ANALYTICS_BACKEND == 'memory':
+            from mains.analytics import get_snapshot  # numpy is only imported with the memory backend
+            return get_snapshot().monthly_totals(**filters)  # Answer from the in-memory columnar snapshot
+        queryset = filter_orders(Order.objects.all(), filters)  # Start with all orders and apply filters
 
         # Aggregate data by month and calculate total quantity sold
         queryset = queryset.annotate(
@@ -58,52 +95,48 @@ class MonthlySalesVolume(generics.ListAPIView):
         return queryset  # Return the filtered and aggregated queryset
 
 
+@method_decorator(snapshot_version_conditional, name='dispatch')
+@method_decorator(use_analytics_db, name='dispatch')
 class MonthlyRevenue(generics.ListAPIView):
     """
     API endpoint to retrieve monthly revenue (total sale value).
 
     Supports filtering by date range, product category, delivery status, and platform.
+    With approx=true, answers from per-month samples and adds error bounds.
     """
     serializer_class = MonthlyRevenueSerializer  # Use the serializer for monthly revenue data
 
+    def get_serializer_class(self):
+        return ApproxMonthlyRevenueSerializer if wants_approx(self.request) else self.serializer_class
+
     def get_queryset(self):
         """
         Returns a queryset of aggregated monthly revenue, filtered by request parameters.
         """
-        queryset = Order.objects.all()  # Start with all orders
-
-        # Get filter parameters from the request
-        start_date = self.request.GET.get('start_date')
-        end_date = self.request.GET.get('end_date')
-        category = self.request.GET.get('category')
-        delivery_status = self.request.GET.get('delivery_status')
-        platform = self.request.GET.get('platform')
-
-        # Apply filters if parameters are provided
-        if start_date:
-            queryset = queryset.filter(date_of_sale__gte=start_date)  # Filter by start date
-        if end_date:
-            queryset = queryset.filter(date_of_sale__lte=end_date)  # Filter by end date
-        if category:
-            queryset = queryset.filter(category=category)  # Filter by product category
-        if delivery_status:
-            queryset = queryset.filter(delivery__delivery_status=delivery_status)  # Filter by delivery status
-        if platform:
-            queryset = queryset.filter(platform__platform_name=platform)  # Filter by platform
+        filters = get_filter_params(self.request)  # Get filter parameters from the request
+        if wants_approx(self.request):
+            from mains.approx import get_approx_index  # numpy is only imported when an approximate answer is asked for
+            return get_approx_index().monthly_totals(**filters)  # Estimate from per-month samples
+        if settings.ANALYTICS_BACKEND == 'memory':
+            from mains.analytics import get_snapshot  # numpy is only imported with the memory backend
+            return get_snapshot().monthly_totals(**filters)  # Answer from the in-memory columnar snapshot
+        queryset = filter_orders(Order.objects.all(), filters)  # Start with all orders and apply filters
 
         # Calculate total sale value and aggregate data by month
         queryset = queryset.annotate(
-            total_sale_value=F('quantity_sold') * F('selling_price'),  # Calculate total sale value for each order
+            total_sale_value_paise=F('quantity_sold') * F('selling_price_paise'),  # Calculate total sale value for each order, in paise
             month=TruncMonth('date_of_sale')  # Truncate date to the beginning of the month
         ).values('month').annotate(
             total_quantity=Sum('quantity_sold'), # Sum of quantities sold per month (optional, if needed)
-            total_revenue=Sum('total_sale_value', output_field=DecimalField())  # Sum the total sale value for each month. output_field is important for decimal places
+            total_revenue_paise=Sum('total_sale_value_paise', output_field=BigIntegerField())  # Integer sum; the serializer converts it to rupees
 
         ).order_by('month')  # Order the results by month
 
         return queryset  # Return the filtered and aggregated queryset
 
 
+@snapshot_version_conditional
+@use_analytics_db
 @api_view(['GET'])
 def summary_metrics(request):
     """
@@ -111,35 +144,26 @@ def summary_metrics(request):
     total products sold, and canceled order percentage.
 
     Supports filtering by date range, product category, delivery status, and platform.
+    With approx=true, returns estimates with ~95% error bounds (the *_error fields)
+    plus approximate distinct customer and product counts.
     """
 
-    # Get filter parameters from the request
-    start_date = request.GET.get('start_date')
-    end_date = request.GET.get('end_date')
-    category = request.GET.get('category')
-    delivery_status = request.GET.get('delivery_status')
-    platform = request.GET.get('platform')
-
-    # Start with all orders and apply filters if provided
-    queryset = Order.objects.all()
-    if start_date:
-        queryset = queryset.filter(date_of_sale__gte=start_date)  # Filter by start date
-    if end_date:
-        queryset = queryset.filter(date_of_sale__lte=end_date)  # Filter by end date
-    if category:
-        queryset = queryset.filter(category=category)  # Filter by product category
-    if delivery_status:
-        queryset = queryset.filter(delivery__delivery_status=delivery_status)  # Filter by delivery status
-    if platform:
-        queryset = queryset.filter(platform__platform_name=platform)  # Filter by platform
+    filters = get_filter_params(request)  # Get filter parameters from the request
+    if wants_approx(request):
+        from mains.approx import get_approx_index  # numpy is only imported when an approximate answer is asked for
+        return response.Response(get_approx_index().summary(**filters))  # Estimate from samples and sketches
+    if settings.ANALYTICS_BACKEND == 'memory':
+        from mains.analytics import get_snapshot  # numpy is only imported with the memory backend
+        return response.Response(get_snapshot().summary(**filters))  # Answer from the in-memory columnar snapshot
+    queryset = filter_orders(Order.objects.all(), filters)  # Start with all orders and apply filters
 
     # Calculate total_sale_value for each order *before* aggregation
     queryset = queryset.annotate(
-        total_sale_value=F('quantity_sold') * F('selling_price'),  # Calculate total sale value
+        total_sale_value_paise=F('quantity_sold') * F('selling_price_paise'),  # Calculate total sale value in paise
     )
 
     # Aggregate metrics
-    total_revenue = queryset.aggregate(total_revenue=Sum('total_sale_value', output_field=DecimalField()))['total_revenue'] or 0  # Sum of total sale values
+    total_revenue_paise = queryset.aggregate(total_revenue_paise=Sum('total_sale_value_paise', output_field=BigIntegerField()))['total_revenue_paise'] or 0  # Sum of total sale values
     total_orders = queryset.count()  # Total number of orders
     total_products_sold = queryset.aggregate(total_products_sold=Sum('quantity_sold'))['total_products_sold'] or 0  # Sum of quantities sold
 
@@ -149,13 +173,15 @@ def summary_metrics(request):
 
     # Prepare the response data
     data = {
-        'total_revenue': total_revenue,
+        'total_revenue': from_paise(total_revenue_paise),  # Rupees only at the response
         'total_orders': total_orders,
         'total_products_sold': total_products_sold,
         'canceled_order_percentage': canceled_order_percentage,
     }
     return response.Response(data)  # Return the summary metrics data
 
+@data_version_conditional
+@use_analytics_db
 @api_view(['GET'])
 def download_filtered_csv(request):
     """
@@ -164,40 +190,72 @@ def download_filtered_csv(request):
     Supports filtering by date range, product category, delivery status, and platform.
     """
 
-    # Get filter parameters from the request
-    start_date = request.GET.get('start_date')
-    end_date = request.GET.get('end_date')
-    category = request.GET.get('category')
-    delivery_status = request.GET.get('delivery_status')
-    platform = request.GET.get('platform')
-
-    # Start with all orders and apply filters if provided
-    queryset = Order.objects.all()
-
-    if start_date:
-        queryset = queryset.filter(date_of_sale__gte=start_date)  # Filter by start date
-    if end_date:
-        queryset = queryset.filter(date_of_sale__lte=end_date)  # Filter by end date
-    if category:
-        queryset = queryset.filter(category=category)  # Filter by product category
-    if delivery_status:
-        queryset = queryset.filter(delivery__delivery_status=delivery_status)  # Filter by delivery status (assuming 'delivery' is a related field)
-    if platform:
-        queryset = queryset.filter(platform__platform_name=platform)  # Filter by platform (assuming 'platform' is a related field)
-
-    # Prepare the CSV response
-    response = HttpResponse(content_type='text/csv')  # Set the content type for CSV
-    response['Content-Disposition'] = 'attachment; filename="filtered_orders.csv"'  # Set the filename for download
+    filters = get_filter_params(request)  # Get filter parameters from the request
+    queryset = filter_orders(Order.objects.all(), filters)  # Start with all orders and apply filters
 
-    writer = csv.writer(response)  # Create a CSV writer object
+    # Rows are produced lazily, so pin the queryset to the analytics database chosen now
+    queryset = queryset.using(analytics_db_alias()).select_related('delivery')
 
     # Write the header row (field names) dynamically
     field_names = [field.name for field in Order._meta.get_fields() if not field.many_to_one]  # Get all field names from the Order model (excluding foreign keys)
-    writer.writerow(field_names)  # Write the field names as the header row
+    field_names = ['selling_price' if name == 'selling_price_paise' else name for name in field_names]  # Export prices in rupees
+
+    def value(obj, field):
+        try:
+            return getattr(obj, field)
+        except ObjectDoesNotExist:  # An order without a Delivery row; raising here would truncate the stream
+            return ''
+
+    def rows():
+        yield field_names
+        for obj in queryset.iterator(chunk_size=2000):  # Stream through the filtered queryset without caching it
+            yield [value(obj, field) for field in field_names]  # Get the value of each field for the current object
+
+    # Stream the CSV so large exports start immediately and are never held in memory
+    writer = csv.writer(Echo())
+    response = StreamingHttpResponse((writer.writerow(row) for row in rows()), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="filtered_orders.csv"'  # Set the filename for download
+    return response  # Return the CSV response
+
 
-    # Write the data rows
-    for obj in queryset:  # Iterate through the filtered queryset
-        row_data = [getattr(obj, field) for field in field_names]  # Get the value of each field for the current object
-        writer.writerow(row_data)  # Write the data row to the CSV
+class TopCustomersPagination(CursorPagination):
+    """
+    Cursor pagination walks customer_revenue_idx directly and never runs a COUNT over all customers.
+    """
+    ordering = ('-lifetime_revenue_paise', 'customer_id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+@method_decorator(data_version_conditional, name='dispatch')
+@method_decorator(use_analytics_db, name='dispatch')
+class TopCustomers(generics.ListAPIView):
+    """
+    API endpoint to retrieve the customer leaderboard by lifetime revenue.
 
-    return response  # Return the CSV response
\ No newline at end of file
+    Reads the precomputed per-customer rollups; use page_size (max 100) and the
+    next/previous links to page through it.
+    """
+    queryset = Customer.objects.filter(order_count__gt=0)
+    serializer_class = TopCustomerSerializer
+    pagination_class = TopCustomersPagination
+
+@data_version_conditional
+@use_analytics_db
+@api_view(['GET'])
+def customer_metrics(request):
+    """
+    API endpoint to retrieve repeat-purchase metrics from the per-customer rollups:
+    total customers, repeat customers, repeat purchase rate and averages per customer.
+    """
+    metrics = Customer.objects.filter(order_count__gt=0).aggregate(
+        total_customers=Count('customer_id'),
+        repeat_customers=Count('customer_id', filter=Q(order_count__gt=1)),  # Customers with more than one order
+        average_orders_per_customer=Avg('order_count'),
+        average_lifetime_revenue=Avg('lifetime_revenue_paise'),
+    )
+    total_customers = metrics['total_customers']
+    metrics['repeat_purchase_rate'] = (metrics['repeat_customers'] / total_customers) * 100 if total_customers else 0  # Percentage of repeat customers
+    metrics['average_orders_per_customer'] = metrics['average_orders_per_customer'] or 0
+    metrics['average_lifetime_revenue'] = from_paise(metrics['average_lifetime_revenue'] or 0)  # Averaged in paise
+    return response.Response(metrics)  # Return the customer metrics data